@@ -1,9 +1,30 @@
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import json
 import os
+import atexit
 import copy
-from datetime import datetime
+import codecs
+import gc
+import math
+import hashlib
+import queue
+import re
+import bisect
+import heapq
+import threading
+import sys
+import time
+import itertools
+import marshal
+import mmap
+import struct
+import zlib
+from collections import Counter, OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 import typing as _typing
 
 # Optional: Google Generative AI (Gemini)
@@ -90,6 +111,8 @@ COLLECTIONS = [
     'counters',
     'notifications',
     'transactions',
+    'micro_grants',
+    'documents',
 ]
 
 DEFAULT_DB = {
@@ -102,6 +125,8 @@ DEFAULT_DB = {
     'counters': [],
     'notifications': [],
     'transactions': [],
+    'micro_grants': [],
+    'documents': [],
     # Keep demo list used by existing /api/data endpoints
     'demoData': [],
     'meta': {
@@ -113,13 +138,19 @@ DEFAULT_DB = {
             'grants': 0,
             'profiles': 0,
             'counters': 0,
+            'micro_grants': 0,
+            'documents': 0,
             'demoData': 0,
         }
     }
 }
 
-def _ensure_db_shape(db):
-    """Ensure the loaded DB has the required shape and counters."""
+def _ensure_db_shape(db, sync_counters=True):
+    """Ensure the loaded DB has the required shape and counters.
+
+    sync_counters=False skips the per-row id scan, for data written by save_db
+    (whose counters are already ahead of every id).
+    """
     if not isinstance(db, dict):
         # Old format (a list) → migrate to demoData list
         migrated = copy.deepcopy(DEFAULT_DB)
@@ -138,6 +169,9 @@ def _ensure_db_shape(db):
     for key in list(COLLECTIONS) + ['demoData']:
         db['meta']['counters'].setdefault(key, 0)
 
+    if not sync_counters:
+        return db
+
     # Sync counters to max existing id per collection to avoid duplicate IDs
     try:
         for key in COLLECTIONS:
@@ -155,22 +189,277 @@ def _ensure_db_shape(db):
 
     return db
 
+# -----------------------------
+# Compact records
+# -----------------------------
+
+# Fixed fields per collection, stored in __slots__; anything else goes to a
+# per-record overflow dict
+RECORD_FIELDS = {
+    'users': ('id', 'version', 'created_at', 'email', 'password', 'role', 'phone',
+              'num_meds_requested', 'pending_approval_meds'),
+    'medicines': ('id', 'version', 'created_at', 'name', 'generic_name', 'description',
+                  'expire_at', 'current_demand', 'required_demand'),
+    'wishlists': ('id', 'version', 'created_at', 'user_id', 'medicine_id', 'quantity',
+                  'approved', 'approved_at', 'rejected_at'),
+    'donations': ('id', 'version', 'created_at', 'donor_id', 'medicine_id', 'medicine_name',
+                  'quantity', 'medicine_expires_at', 'claimed_by', 'claimed_at', 'claim_status',
+                  'claim_decided_at', 'expired'),
+    'grants': ('id', 'version', 'created_at', 'requestor_id', 'title', 'description'),
+    'profiles': ('id', 'version', 'created_at', 'user_id', 'first_name', 'last_name', 'phone',
+                 'address', 'emergency_contact', 'date_of_birth', 'bio', 'medical_conditions',
+                 'allergies', 'avatar_url', 'avatar_thumb_url', 'avatar_hash'),
+    'counters': ('id', 'version', 'created_at', 'user_id', 'medicine_purchases', 'donations',
+                 'grant_given'),
+    'notifications': ('id', 'version', 'created_at', 'user_id', 'type', 'title', 'message',
+                      'read', 'action_url'),
+    'transactions': ('id', 'version', 'created_at', 'user_id', 'type', 'amount', 'note'),
+    'micro_grants': ('id', 'version', 'created_at', 'requestor_id', 'requesterName', 'title',
+                     'description', 'amountNeeded', 'amountRaised', 'timePosted', 'supporters',
+                     'verified', 'urgent'),
+    'documents': ('id', 'version', 'created_at', 'user_id', 'filename', 'chunk_count', 'chars'),
+}
+
+# Low-cardinality string fields shared via sys.intern
+INTERNED_FIELDS = frozenset({'type', 'role', 'claim_status', 'condition', 'title'})
+
+# Timestamp fields held as datetimes when the stored string round-trips exactly
+TIMESTAMP_FIELDS = frozenset({
+    'created_at', 'claimed_at', 'claim_decided_at', 'approved_at', 'rejected_at', 'expired_flagged_at',
+})
+
+_MISSING = object()
+
+def _compact_ts(value):
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    return dt if dt.tzinfo is None and dt.isoformat() == value else value
+
+class _Record(MutableMapping):
+    """A row that behaves like the plain dict it replaces, at a fraction of the memory.
+
+    Declared fields live in __slots__ (no per-row hash table), enum-like
+    strings are interned and timestamps kept as datetimes; get()/[] still
+    return the original JSON values, and dict(record) is what gets serialized.
+    """
+    __slots__ = ('_extra',)
+    _slot_of: _typing.Dict[str, str] = {}
+
+    def __init__(self, data=None):
+        self._extra = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    def raw(self, key, default=None):
+        """Stored value (datetimes unformatted), for indexes and comparisons."""
+        slot = self._slot_of.get(key)
+        if slot is not None:
+            value = getattr(self, slot, _MISSING)
+            return default if value is _MISSING else value
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def get(self, key, default=None):
+        slot = self._slot_of.get(key)
+        if slot is not None:
+            value = getattr(self, slot, _MISSING)
+        elif self._extra is not None:
+            value = self._extra.get(key, _MISSING)
+        else:
+            return default
+        if value is _MISSING:
+            return default
+        return value.isoformat() if type(value) is datetime else value
+
+    def __getitem__(self, key):
+        value = self.raw(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value.isoformat() if type(value) is datetime else value
+
+    def __setitem__(self, key, value):
+        slot = self._slot_of.get(key)
+        if slot is None:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+            return
+        if type(value) is str:
+            if key in INTERNED_FIELDS:
+                value = sys.intern(value)
+            elif key in TIMESTAMP_FIELDS:
+                value = _compact_ts(value)
+        setattr(self, slot, value)
+
+    def __delitem__(self, key):
+        slot = self._slot_of.get(key)
+        if slot is not None and hasattr(self, slot):
+            delattr(self, slot)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key, slot in self._slot_of.items():
+            if hasattr(self, slot):
+                yield key
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        return self.raw(key, _MISSING) is not _MISSING
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+def _record_class(collection, fields):
+    slot_of = {field: 'f_' + field for field in fields}
+    return type(f'_{collection.title().replace("_", "")}Record', (_Record,), {
+        '__slots__': tuple(slot_of.values()),
+        '_slot_of': slot_of,
+    })
+
+_RECORD_CLASSES = {name: _record_class(name, fields) for name, fields in RECORD_FIELDS.items()}
+
+def _make_record(collection, data):
+    cls = _RECORD_CLASSES.get(collection)
+    if cls is None or type(data) is cls:
+        return data
+    return cls(data)
+
+def _compact_rows(db):
+    """Convert a loaded DB's rows to compact records in place."""
+    for collection in _RECORD_CLASSES:
+        items = db.get(collection)
+        cls = _RECORD_CLASSES[collection]
+        if isinstance(items, list) and any(type(i) is not cls for i in items):
+            db[collection] = [_make_record(collection, i) if isinstance(i, dict) else i for i in items]
+    return db
+
+def _raw_field(item, field):
+    return item.raw(field) if isinstance(item, _Record) else item.get(field)
+
+def _json_default(value):
+    if isinstance(value, _Record):
+        return dict(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+class _JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes compact records like dicts."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, _Record):
+            return dict(o)
+        return DefaultJSONProvider.default(o)
+
+app.json = _JSONProvider(app)
+
+# In-memory copy of the DB, reused until its files change on disk.
+# _DB_LOCK guards short in-memory critical sections (mutations, collecting
+# dirty partitions); each partition file is written under its own lock so
+# requests do not wait on fsync, nor on writes to other partitions.
+_DB_LOCK = threading.RLock()
+_DB_CACHE = {'db': None, 'stamps': {}, 'generation': {}, 'written': {}}
+
+def _file_stamp(path):
+    """Identify the on-disk version of a file (mtime + size), or None if missing."""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
 def load_db():
-    """Load the entire DB object from disk, ensuring shape/migration."""
-    if os.path.exists(DATA_FILE):
+    """Load the entire DB object, ensuring shape/migration.
+
+    The parsed DB is cached in memory and only re-read when data.json or a
+    partition file changes on disk (e.g. written by another process); indexes
+    are rebuilt on reload.
+    """
+    with _DB_LOCK:
+        if _DB_CACHE['db'] is not None and all(
+            _file_stamp(_part_path(part)) == stamp for part, stamp in _DB_CACHE['stamps'].items()
+        ):
+            return _DB_CACHE['db']
+        # Loading allocates millions of objects at scale, none of them garbage;
+        # cyclic GC passes over the growing heap would only slow it down
+        gc_enabled = gc.isenabled()
+        gc.disable()
         try:
-            with open(DATA_FILE, 'r') as f:
-                db = json.load(f)
-        except Exception:
-            db = copy.deepcopy(DEFAULT_DB)
-    else:
-        db = copy.deepcopy(DEFAULT_DB)
-    return _ensure_db_shape(db)
+            db, origins, stamps, stale = _load_partitions()
+            db = _compact_rows(db)
+            _DB_CACHE['db'] = db
+            _DB_CACHE['stamps'] = stamps
+            _PARTITIONS.origins = origins
+            _rebuild_indexes(db)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        # e.g. data.json still holding rows moved to partitions
+        _PARTITIONS.dirty.update(stale)
+        return db
 
 def save_db(db):
-    """Persist the entire DB object to disk."""
-    with open(DATA_FILE, 'w') as f:
-        json.dump(db, f, indent=2)
+    """Persist the partitions of the DB changed since the last save.
+
+    Dirty partitions are collected under the DB lock (a consistent state) and
+    written outside it, each under its own lock, so writers to different
+    users' partitions proceed in parallel. Every file is replaced atomically
+    via a temp file; an encoding older than what is already on disk is skipped.
+    data.json goes after every partition of this save is on disk, so it never
+    drops rows (e.g. legacy single-file ones) that no partition file holds
+    yet; partition files retired by a smaller DB_PARTITIONS are removed only
+    after that. A part whose write fails is retried by the next save.
+    """
+    with _DB_LOCK:
+        if db is not _DB_CACHE['db']:
+            _DB_CACHE['db'] = _compact_rows(db)
+            _rebuild_indexes(db)
+        if not _PARTITIONS.dirty:
+            # Writes outside the row hooks (demoData, meta) live in data.json
+            _PARTITIONS.dirty.add(GLOBAL_PART)
+        jobs = []
+        for part, payload in _PARTITIONS.take(db).items():
+            generation = _DB_CACHE['generation'].get(part, 0) + 1
+            _DB_CACHE['generation'][part] = generation
+            jobs.append((part, generation, payload))
+    error = None
+    # Partitions, then data.json, then removal of retired partition files
+    for part, generation, payload in sorted(jobs, key=lambda job: (job[0] == GLOBAL_PART) + 2 * _retired(job[0])):
+        if (part == GLOBAL_PART or payload is None) and error is not None:
+            break
+        with _PART_LOCKS.setdefault(part, threading.Lock()):
+            if generation <= _DB_CACHE['written'].get(part, 0):
+                continue
+            try:
+                tmp_path = _write_part(part, payload) if payload is not None else None
+                # The rename and stamp update are one step for load_db, so our
+                # own write never looks like an external change
+                with _DB_LOCK:
+                    if tmp_path is not None:
+                        os.replace(tmp_path, _part_path(part))
+                    elif os.path.exists(_part_path(part)):
+                        os.remove(_part_path(part))
+                    _DB_CACHE['stamps'][part] = _file_stamp(_part_path(part))
+                    _DB_CACHE['written'][part] = generation
+                    if generation == _DB_CACHE['generation'].get(part):
+                        _PARTITIONS.unwritten.discard(part)
+            except Exception as exc:
+                error = error or exc
+    if error is not None:
+        raise error
 
 def _next_id(db, collection):
     """Get the next auto-incrementing id for a collection and advance it."""
@@ -189,6 +478,7 @@ def save_data(data):
     """Save legacy demo list used by /api/data endpoints."""
     db = load_db()
     db['demoData'] = data
+    _touch_key('demoData')
     db['meta']['counters']['demoData'] = len(data)
     save_db(db)
 
@@ -265,6 +555,131 @@ def clear_all_data():
 # Chatbot (Gemini) endpoint
 # -----------------------------
 
+# Quick-mode latency control: the full-length fallback is hedged after
+# CHAT_HEDGE_DELAY seconds (or as soon as the quick answer comes back empty),
+# and nothing waits past CHAT_DEADLINE
+CHAT_HEDGE_DELAY = float(os.getenv('CHAT_HEDGE_DELAY', '2.0'))
+CHAT_DEADLINE = float(os.getenv('CHAT_DEADLINE', '15.0'))
+CHAT_TIMEOUT_REPLY = (
+    "Sorry, I'm taking longer than usual to respond. Please try again in a moment."
+)
+QUICK_GENERATION_CONFIG = {
+    'max_output_tokens': 120,
+    'temperature': 0.4,
+    'top_p': 0.8,
+    'top_k': 40,
+}
+
+# Hedged attempts only; every request's first attempt gets a thread of its own
+_CHAT_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('CHAT_WORKERS', '8')), thread_name_prefix='chat')
+# Recent (latency seconds, outcome, queue wait seconds) for /api/chat/stats
+_CHAT_LATENCIES: deque = deque(maxlen=1000)
+
+def _run_in_thread(fn):
+    """Start fn() on a new daemon thread; returns its Future."""
+    future = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+
+    threading.Thread(target=run, name='chat', daemon=True).start()
+    return future
+
+def _hedged_generate(attempts, hedge_delay, deadline):
+    """Run generation attempts with hedging under an overall deadline.
+
+    attempts are callables taking the seconds left and returning text. The
+    first starts at once on its own thread, so it never waits behind other
+    requests; each next one goes to _CHAT_POOL after hedge_delay, or as soon
+    as every running attempt has failed or come back empty. The first
+    non-empty text wins and attempts still queued are cancelled; running ones
+    are abandoned (their own timeout bounds them). Returns (text or None,
+    index of the winning attempt, or 'deadline' / 'deadline_queued' (a hedge
+    was still waiting for a worker) / 'empty', seconds attempts spent queued).
+    """
+    start = time.monotonic()
+    end = start + deadline
+    running = {}
+    launched = 0
+    queued_at, waited = {}, {}
+
+    def launch():
+        nonlocal launched
+        index = launched
+
+        def run():
+            waited[index] = time.monotonic() - queued_at[index]
+            return attempts[index](max(end - time.monotonic(), 0.001))
+
+        queued_at[index] = time.monotonic()
+        future = _run_in_thread(run) if index == 0 else _CHAT_POOL.submit(run)
+        running[future] = index
+        launched += 1
+
+    def queue_wait():
+        now = time.monotonic()
+        return sum(waited.get(i, now - t) for i, t in queued_at.items())
+
+    launch()
+    next_hedge = start + hedge_delay
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                outcome = 'deadline_queued' if len(waited) < launched else 'deadline'
+                return None, outcome, queue_wait()
+            if launched < len(attempts) and (now >= next_hedge or not running):
+                launch()
+                next_hedge = now + hedge_delay
+                continue
+            if not running:
+                return None, 'empty', queue_wait()
+            wake = end if launched >= len(attempts) else min(end, next_hedge)
+            done, _ = wait(list(running), timeout=max(wake - now, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    app.logger.info('Chat attempt %s failed: %s', index, e)
+                    continue
+                if text:
+                    return text, index, queue_wait()
+    finally:
+        for future in running:
+            future.cancel()
+
+def _gemini_attempt(model, prompt, generation_config=None):
+    def attempt(remaining):
+        kwargs = {'request_options': {'timeout': remaining}}
+        if generation_config:
+            kwargs['generation_config'] = generation_config
+        return _extract_text_from_response(model.generate_content(prompt, **kwargs))
+    return attempt
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+@app.route('/api/chat/stats', methods=['GET'])
+def chat_stats():
+    """Latency percentiles (ms) and outcomes of recent /api/chat calls."""
+    samples = list(_CHAT_LATENCIES)
+    latencies = [s for s, _, _ in samples]
+    waits = [w for _, _, w in samples]
+    return jsonify({
+        'count': len(samples),
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 1) if samples else None,
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1) if samples else None,
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1) if samples else None,
+        'queue_p95_ms': round(_percentile(waits, 0.95) * 1000, 1) if samples else None,
+        'outcomes': dict(Counter(o for _, o, _ in samples)),
+    })
+
 @app.route('/api/chat', methods=['POST'])
 def chat_route():
     try:
@@ -283,13 +698,27 @@ def chat_route():
             messages = request.json.get('messages', []) if request.is_json else []
 
         prompt = _collapse_messages_for_llm(messages)
+        if request.content_type and 'multipart/form-data' in request.content_type:
+            user_id = request.form.get('user_id')
+        else:
+            user_id = (request.json or {}).get('user_id') if request.is_json else None
 
-        # If a file is attached, prepend a note
+        # If a file is attached, ingest it and prepend a note
         uploaded_file = None
         try:
             uploaded_file = request.files.get('file')
         except Exception:
             uploaded_file = None
+        upload_index = None
+        if uploaded_file is not None:
+            try:
+                _doc, upload_index = ingest_document(user_id, uploaded_file)
+            except Exception:
+                upload_index = None
+        # Only the most relevant document chunks are sent, not whole documents
+        context = _document_context(user_id, _last_user_message(messages), extra_index=upload_index)
+        if context:
+            prompt = f"{context}\n\n{prompt}"
         if uploaded_file is not None:
             prompt = f"[User uploaded file: {uploaded_file.filename}]\n" + prompt
 
@@ -324,27 +753,27 @@ def chat_route():
             quick = False
 
         model = _genai.GenerativeModel(_GEMINI_MODEL)
+        attempts = [_gemini_attempt(model, full_prompt)]
+        labels = ['full']
         if quick:
-            resp = model.generate_content(full_prompt, generation_config={
-                'max_output_tokens': 120,
-                'temperature': 0.4,
-                'top_p': 0.8,
-                'top_k': 40,
-            })
-        else:
-            resp = model.generate_content(full_prompt)
-        # Robust extraction across shapes
-        reply = _extract_text_from_response(resp)
-        # If quick mode produced no text, fall back to a standard generation
-        if quick and not reply:
-            try:
-                resp_full = model.generate_content(full_prompt)
-                reply = _extract_text_from_response(resp_full)
-            except Exception:
-                pass
-        if not reply:
+            # Quick answer first, full generation hedged behind it
+            attempts.insert(0, _gemini_attempt(model, full_prompt, QUICK_GENERATION_CONFIG))
+            labels.insert(0, 'quick')
+        started = time.monotonic()
+        reply, outcome, queued = _hedged_generate(attempts, CHAT_HEDGE_DELAY, CHAT_DEADLINE)
+        if isinstance(outcome, int):
+            outcome = labels[outcome]
+        elapsed = time.monotonic() - started
+        _CHAT_LATENCIES.append((elapsed, outcome, queued))
+        if outcome.startswith('deadline'):
+            reply = CHAT_TIMEOUT_REPLY
+        elif not reply:
             reply = "I couldn't generate a response. Please try again."
-        return jsonify({'reply': reply})
+        response = jsonify({'reply': reply})
+        response.headers['X-Chat-Latency-Ms'] = str(round(elapsed * 1000))
+        response.headers['X-Chat-Outcome'] = outcome
+        response.headers['X-Chat-Queue-Ms'] = str(round(queued * 1000))
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -364,6 +793,9 @@ def chat_stream_route():
         quick = bool(request.json.get('quick', False))
 
         prompt = _collapse_messages_for_llm(messages)
+        context = _document_context(request.json.get('user_id'), _last_user_message(messages))
+        if context:
+            prompt = f"{context}\n\n{prompt}"
 
         system_instruction = (
             "You are MedSplit, a compassionate healthcare advisor assistant. "
@@ -385,7 +817,7 @@ def chat_stream_route():
         _genai.configure(api_key=_GEMINI_API_KEY)
 
         model = _genai.GenerativeModel(_GEMINI_MODEL)
-        gen_cfg = {'max_output_tokens': 120, 'temperature': 0.4, 'top_p': 0.8, 'top_k': 40} if quick else None
+        gen_cfg = QUICK_GENERATION_CONFIG if quick else None
 
         def event_stream():
             try:
@@ -413,6 +845,388 @@ def chat_stream_route():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# -----------------------------
+# Document ingestion & retrieval (chat context)
+# -----------------------------
+
+# Optional: NumPy for vectorized TF-IDF scoring; falls back to pure Python
+try:
+    import numpy as _np  # type: ignore
+except Exception:
+    _np = None
+
+DOCUMENT_DIR = os.getenv('DOCUMENT_DIR') or os.path.join(os.path.dirname(__file__), 'documents')
+DOCUMENT_MAX_BYTES = 10 * 1024 * 1024
+CHUNK_CHARS = 1000
+CHUNK_OVERLAP = 150
+RETRIEVAL_TOP_K = 4
+RETRIEVAL_MAX_CHARS = 4000
+_TEXT_EXTENSIONS = ('.txt', '.md', '.csv', '.json', '.log', '.html', '.xml', '.pdf')
+_TOKEN_RE = re.compile(r'[a-z0-9]{2,}')
+
+def _tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+def _last_user_message(messages):
+    for m in reversed(messages if isinstance(messages, list) else []):
+        if isinstance(m, dict) and str(m.get('role', 'user')).lower() == 'user':
+            return str(m.get('content', ''))
+    return ''
+
+def _is_ingestible(uploaded):
+    name = (uploaded.filename or '').lower()
+    return name.endswith(_TEXT_EXTENSIONS) or (uploaded.mimetype or '').startswith('text/')
+
+def _iter_text_blocks(uploaded):
+    """Yield text from an upload block by block (PDF pages via pypdf when installed)."""
+    stream = uploaded.stream
+    if (uploaded.filename or '').lower().endswith('.pdf'):
+        try:
+            from pypdf import PdfReader  # type: ignore
+        except Exception:
+            return
+        for page in PdfReader(stream).pages:
+            yield (page.extract_text() or '') + '\n'
+        return
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    total = 0
+    while total < DOCUMENT_MAX_BYTES:
+        block = stream.read(64 * 1024)
+        if not block:
+            break
+        total += len(block)
+        yield decoder.decode(block)
+    yield decoder.decode(b'', final=True)
+
+def _chunk_text(blocks, size=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """Cut streamed text into ~size-char chunks at whitespace, overlapping by `overlap`."""
+    buf = ''
+    for block in blocks:
+        buf += block
+        while len(buf) >= size:
+            cut = max(buf.rfind(' ', size // 2, size), buf.rfind('\n', size // 2, size))
+            if cut <= 0:
+                cut = size
+            chunk = ' '.join(buf[:cut].split())
+            if chunk:
+                yield chunk
+            # Start the next chunk `overlap` chars back, on a word boundary
+            start = buf.find(' ', cut - overlap, cut)
+            buf = buf[start + 1 if start >= 0 else cut - overlap:]
+    tail = ' '.join(buf.split())
+    if tail:
+        yield tail
+
+class _DocumentIndex:
+    """TF-IDF index over one user's document chunks.
+
+    Term postings are NumPy arrays, so scoring a query only touches the chunks
+    containing its terms; the index is rebuilt lazily after ingestion.
+    """
+
+    def __init__(self):
+        self.chunks: _typing.List[tuple] = []    # (document_id, filename, text)
+        self._counts: _typing.List[Counter] = []
+        self._postings = None                     # term -> (chunk ids, weights)
+        self._idf: _typing.Dict[str, float] = {}
+        self._norms = None
+
+    def add(self, document_id, filename, texts):
+        for text in texts:
+            self.chunks.append((document_id, filename, text))
+            self._counts.append(Counter(_tokenize(text)))
+        self._postings = None
+
+    def remove(self, document_id):
+        keep = [i for i, chunk in enumerate(self.chunks) if chunk[0] != document_id]
+        self.chunks = [self.chunks[i] for i in keep]
+        self._counts = [self._counts[i] for i in keep]
+        self._postings = None
+
+    def _build(self):
+        n = len(self.chunks)
+        lists: _typing.Dict[str, tuple] = {}
+        for i, counts in enumerate(self._counts):
+            for term, tf in counts.items():
+                ids, tfs = lists.setdefault(term, ([], []))
+                ids.append(i)
+                tfs.append(tf)
+        self._idf = {term: math.log((1 + n) / (1 + len(ids))) + 1 for term, (ids, _) in lists.items()}
+        norms = [0.0] * n
+        postings = {}
+        for term, (ids, tfs) in lists.items():
+            idf = self._idf[term]
+            weights = [math.log1p(tf) * idf for tf in tfs]
+            for i, w in zip(ids, weights):
+                norms[i] += w * w
+            postings[term] = (_np.asarray(ids), _np.asarray(weights)) if _np is not None else (ids, weights)
+        norms = [math.sqrt(v) or 1.0 for v in norms]
+        self._norms = _np.asarray(norms) if _np is not None else norms
+        self._postings = postings
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        """Top-k (score, chunk) pairs by cosine similarity to the query."""
+        if not self.chunks:
+            return []
+        if self._postings is None:
+            self._build()
+        query_terms = [(t, math.log1p(tf) * self._idf[t]) for t, tf in Counter(_tokenize(query)).items() if t in self._idf]
+        if not query_terms:
+            return []
+        if _np is not None:
+            scores = _np.zeros(len(self.chunks))
+            for term, qw in query_terms:
+                ids, weights = self._postings[term]
+                scores[ids] += weights * qw
+            scores /= self._norms
+            k = min(k, len(scores))
+            top = _np.argpartition(-scores, k - 1)[:k]
+            hits = sorted(((float(scores[i]), int(i)) for i in top if scores[i] > 0), reverse=True)
+        else:
+            acc: _typing.Dict[int, float] = {}
+            for term, qw in query_terms:
+                for i, w in zip(*self._postings[term]):
+                    acc[i] = acc.get(i, 0.0) + w * qw
+            hits = sorted(((s / self._norms[i], i) for i, s in acc.items()), reverse=True)[:k]
+        return [(score, self.chunks[i]) for score, i in hits]
+
+_DOC_INDEXES: _typing.Dict[str, _DocumentIndex] = {}
+_DOC_INDEX_LOCK = threading.Lock()
+
+def _document_chunks_path(document_id):
+    return os.path.join(DOCUMENT_DIR, f'{document_id}.jsonl')
+
+def _read_document_chunks(document_id):
+    try:
+        with open(_document_chunks_path(document_id), 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except OSError:
+        return []
+
+def _user_document_index(user_id):
+    """The user's index, loaded from stored chunks on first use."""
+    key = str(user_id)
+    with _DOC_INDEX_LOCK:
+        index = _DOC_INDEXES.get(key)
+        if index is None:
+            index = _DocumentIndex()
+            for doc in load_db().get('documents', []):
+                if str(doc.get('user_id')) == key:
+                    index.add(doc.get('id'), doc.get('filename'), _read_document_chunks(doc.get('id')))
+            _DOC_INDEXES[key] = index
+        return index
+
+def ingest_document(user_id, uploaded):
+    """Chunk an uploaded text/PDF file and add it to the user's retrieval index.
+
+    Returns (document record, index holding the new chunks). Without a user_id
+    the chunks go to a throwaway index and no record is stored; (None, None)
+    means the file had no extractable text.
+    """
+    if not _is_ingestible(uploaded):
+        return None, None
+    chunks = list(_chunk_text(_iter_text_blocks(uploaded)))
+    if not chunks:
+        return None, None
+    if not user_id:
+        index = _DocumentIndex()
+        index.add(None, uploaded.filename, chunks)
+        return None, index
+    with _DB_LOCK:
+        db = load_db()
+        doc = _insert_item(db, 'documents', {
+            'user_id': user_id,
+            'filename': uploaded.filename,
+            'chunk_count': len(chunks),
+            'chars': sum(len(c) for c in chunks),
+        })
+    os.makedirs(DOCUMENT_DIR, exist_ok=True)
+    _write_json_lines(_document_chunks_path(doc['id']), chunks)
+    save_db(db)
+    index = _user_document_index(user_id)
+    with _DOC_INDEX_LOCK:
+        if not any(chunk[0] == doc['id'] for chunk in index.chunks):
+            index.add(doc['id'], uploaded.filename, chunks)
+    return doc, index
+
+def _write_json_lines(path, values):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for value in values:
+            f.write(json.dumps(value) + '\n')
+    os.replace(tmp_path, path)
+
+def _document_context(user_id, question, extra_index=None):
+    """Prompt block with the chunks most relevant to the question (bounded size)."""
+    if not question.strip():
+        return ''
+    hits = []
+    indexes = [_user_document_index(user_id)] if user_id else []
+    if extra_index is not None and all(extra_index is not i for i in indexes):
+        indexes.append(extra_index)
+    with _DOC_INDEX_LOCK:
+        for index in indexes:
+            hits.extend(index.search(question))
+    if not hits:
+        return ''
+    lines = ["[Relevant excerpts from the user's documents]"]
+    used = 0
+    for _score, (_doc_id, filename, text) in sorted(hits, key=lambda h: h[0], reverse=True)[:RETRIEVAL_TOP_K]:
+        if used + len(text) > RETRIEVAL_MAX_CHARS:
+            break
+        lines.append(f"({filename}) {text}")
+        used += len(text)
+    return "\n".join(lines) if len(lines) > 1 else ''
+
+@app.route('/api/documents', methods=['GET'])
+def list_documents():
+    return _list_items('documents')
+
+@app.route('/api/documents', methods=['POST'])
+def upload_document():
+    """Ingest a text/PDF document (multipart `file` + `user_id`) for chat retrieval."""
+    uploaded = request.files.get('file')
+    user_id = request.form.get('user_id')
+    if uploaded is None or not user_id:
+        return jsonify({'error': 'file and user_id are required'}), 400
+    doc, _index = ingest_document(user_id, uploaded)
+    if doc is None:
+        return jsonify({'error': 'No text could be extracted from this file'}), 415
+    return jsonify(doc), 201
+
+@app.route('/api/documents/<int:item_id>', methods=['DELETE'])
+def delete_document(item_id):
+    db = load_db()
+    doc = _find_by_id(db.get('documents', []), item_id)
+    response = _delete_item('documents', item_id)
+    if doc is not None:
+        try:
+            os.remove(_document_chunks_path(item_id))
+        except OSError:
+            pass
+        with _DOC_INDEX_LOCK:
+            index = _DOC_INDEXES.get(str(doc.get('user_id')))
+            if index is not None:
+                index.remove(item_id)
+    return response
+
+# -----------------------------
+# Text normalization
+# -----------------------------
+
+# Max characters per string field; FIELD_SIZE_LIMIT covers fields not listed
+FIELD_SIZE_LIMIT = int(os.getenv('FIELD_SIZE_LIMIT', '10000'))
+FIELD_SIZE_LIMITS = {
+    'name': 200,
+    'generic_name': 200,
+    'medicine_name': 200,
+    'title': 200,
+    'description': 5000,
+    'message': 2000,
+    'bio': 2000,
+    'notes': 2000,
+}
+# Stored exactly as given: neither repaired nor limited
+_VERBATIM_FIELDS = {'password'}
+
+# A lead byte of a UTF-8 sequence read as Windows-1252/Latin-1, followed by a
+# continuation byte read the same way: the signature of mis-decoded UTF-8
+_MOJIBAKE_RE = re.compile(
+    '[Â-ô][\u0080-¿ŒœŠšŸŽžƒ'
+    'ˆ˜–—‘-‚“-„†-•…‰'
+    '‹›€™]'
+)
+
+def _cp1252_passthrough(error):
+    # Bytes 0x81/0x8D/0x8F/0x90/0x9D have no cp1252 character and survive
+    # mis-decoding as the matching code points
+    chars = error.object[error.start:error.end]
+    if all(ord(ch) < 256 for ch in chars):
+        return bytes(ord(ch) for ch in chars), error.end
+    raise error
+
+codecs.register_error('medsplit.cp1252', _cp1252_passthrough)
+
+def repair_text(text):
+    """Undo (possibly repeated) UTF-8 → Windows-1252 mis-decoding; other text is returned as is."""
+    for _ in range(32):
+        if not _MOJIBAKE_RE.search(text):
+            break
+        try:
+            fixed = text.encode('cp1252', 'medsplit.cp1252').decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            break
+        if len(fixed) >= len(text):
+            break
+        text = fixed
+    return text
+
+def _field_limit(field):
+    return FIELD_SIZE_LIMITS.get(field, FIELD_SIZE_LIMIT)
+
+def _normalize_value(value):
+    if isinstance(value, str):
+        return repair_text(value)
+    if isinstance(value, list):
+        return [repair_text(v) if isinstance(v, str) else v for v in value]
+    return value
+
+def normalize_payload(payload):
+    """Repair mis-decoded text in a write payload and enforce field size limits.
+
+    Returns (payload, error message); the message names the first field still
+    over its limit after repair.
+    """
+    normalized = {}
+    for field, value in (payload or {}).items():
+        if field in _VERBATIM_FIELDS:
+            normalized[field] = value
+            continue
+        value = _normalize_value(value)
+        limit = _field_limit(field)
+        if isinstance(value, str) and len(value) > limit:
+            return None, f'{field} exceeds {limit} characters'
+        normalized[field] = value
+    return normalized, None
+
+def repair_stored_text(dry_run=False):
+    """Scan every collection for mis-decoded or oversized string fields and fix them.
+
+    Mojibake is repaired; text still over its limit is truncated. Returns a
+    report of the affected fields with their sizes before and after.
+    """
+    report = []
+    with _DB_LOCK:
+        db = load_db()
+        for collection in COLLECTIONS:
+            for item in db.get(collection, []):
+                changed = False
+                for field in list(item.keys()):
+                    if field in _VERBATIM_FIELDS:
+                        continue
+                    value = item.get(field)
+                    fixed = _normalize_value(value)
+                    limit = _field_limit(field)
+                    if isinstance(fixed, str) and len(fixed) > limit:
+                        fixed = fixed[:limit]
+                    if fixed == value:
+                        continue
+                    report.append({
+                        'collection': collection,
+                        'id': item.get('id'),
+                        'field': field,
+                        'before': len(json.dumps(value)),
+                        'after': len(json.dumps(fixed)),
+                    })
+                    if not dry_run:
+                        item[field] = fixed
+                        changed = True
+                if changed:
+                    _touch(collection, item)
+    if report and not dry_run:
+        save_db(db)
+    return report
+
 # -----------------------------
 # Generic helpers for CRUD
 # -----------------------------
@@ -423,64 +1237,1882 @@ def _find_by_id(items, item_id):
             return item
     return None
 
-def _list_items(collection):
-    db = load_db()
-    items = db.get(collection, [])
-    # Basic filtering by simple equality on query params
-    if request.args:
-        filtered = []
-        for item in items:
-            include = True
-            for key, value in request.args.items():
-                if key == 'query':
-                    # handled elsewhere (e.g., search)
-                    continue
-                if str(item.get(key)) != value:
-                    include = False
-                    break
-            if include:
-                filtered.append(item)
-        items = filtered
-    return jsonify(items)
+def _list_items(collection, args=None):
+    args = request.args if args is None else args
+    db = load_db()
+    items = db.get(collection, [])
+    try:
+        items = _filter_items(collection, items, args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_rows_snapshot(items))
+
+def _not_found(collection):
+    return jsonify({'error': f'{collection[:-1].capitalize()} not found'}), 404
+
+def _with_etag(response, item):
+    response.headers['ETag'] = f'"{int(item.get("version", 0))}"'
+    return response
+
+def _rows_snapshot(items):
+    """Shallow copies of rows taken under the DB lock, safe to serialize while writers run."""
+    with _DB_LOCK:
+        return [dict(i) for i in items]
+
+def _get_item(collection, item_id):
+    load_db()
+    with _DB_LOCK:
+        item = _ROWS.get(collection, {}).get(int(item_id))
+        item = dict(item) if item else None
+    if not item:
+        return _not_found(collection)
+    return _with_etag(jsonify(item), item)
+
+def _insert_item(db, collection, payload, defaults=None, item_id=None):
+    """Add an item to a loaded DB (id, created_at, version, indexes) without saving.
+
+    item_id keeps a caller-chosen free id (bulk import); the counter moves past it.
+    """
+    with _DB_LOCK:
+        item = _make_record(collection, {**(defaults or {}), **(payload or {})})
+        if item_id is None:
+            item['id'] = _next_id(db, collection)
+        else:
+            item['id'] = item_id
+            counters = db['meta']['counters']
+            counters[collection] = max(int(counters.get(collection, 0)), item_id)
+        item['version'] = 1
+        # Add created_at if not provided
+        item.setdefault('created_at', datetime.now().isoformat())
+        db[collection].append(item)
+        _index_put(collection, item)
+        return item
+
+def _touch(collection, item):
+    """Bump a record's version after an in-place write and refresh its indexes."""
+    item['version'] = int(item.get('version', 0)) + 1
+    _index_put(collection, item)
+
+def _expected_version(payload=None):
+    """Version a write was based on: If-Match header, else payload expected_version.
+
+    Returns None for unconditional writes; raises ValueError when malformed.
+    """
+    raw = request.headers.get('If-Match')
+    if raw is not None and raw.strip() != '*':
+        raw = raw.strip()
+        if raw.startswith('W/'):
+            raw = raw[2:]
+        return int(raw.strip('"'))
+    if payload and payload.get('expected_version') is not None:
+        return int(payload.get('expected_version'))
+    return None
+
+def _conditional_update(collection, item_id, mutate, expected=None):
+    """Compare-and-set a record: apply mutate(item) only if its version still matches.
+
+    The check, mutation and version bump happen atomically under the DB lock,
+    so concurrent requests cannot both act on the same state. mutate may return
+    a response tuple to abort without changes. Returns (item copy, None) on
+    success or (None, error response).
+    """
+    with _DB_LOCK:
+        db = load_db()
+        item = _ROWS.get(collection, {}).get(int(item_id))
+        if not item:
+            return None, _not_found(collection)
+        current = int(item.get('version', 0))
+        if expected is not None and expected != current:
+            return None, (jsonify({'error': 'Version conflict', 'version': current, 'current': dict(item)}), 409)
+        error = mutate(item)
+        if error is not None:
+            return None, error
+        _touch(collection, item)
+        result = dict(item)
+    save_db(db)
+    return result, None
+
+def _create_item(collection, payload, defaults=None):
+    payload, error = normalize_payload(payload)
+    if error is None:
+        defaults, error = normalize_payload(defaults)
+    if error is not None:
+        return jsonify({'error': error}), 400
+    db = load_db()
+    item = _insert_item(db, collection, payload, defaults=defaults)
+    save_db(db)
+    return _with_etag(jsonify(item), item), 201
+
+def _update_item(collection, item_id, payload):
+    """Update fields; honours If-Match / expected_version with 409 on conflict."""
+    try:
+        expected = _expected_version(payload)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'If-Match / expected_version must be a version number'}), 400
+    # Prevent id/version overwrite
+    payload = {k: v for k, v in (payload or {}).items() if k not in ('id', 'version', 'expected_version')}
+    payload, error = normalize_payload(payload)
+    if error is not None:
+        return jsonify({'error': error}), 400
+    item, error = _conditional_update(collection, item_id, lambda i: i.update(payload), expected)
+    if error is not None:
+        return error
+    return _with_etag(jsonify(item), item)
+
+def _delete_item(collection, item_id, on_delete=None):
+    """Delete a row; on_delete(item) runs under the DB lock once it is certain to go."""
+    try:
+        expected = _expected_version()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'If-Match must be a version number'}), 400
+    with _DB_LOCK:
+        db = load_db()
+        item = _ROWS.get(collection, {}).get(int(item_id))
+        if not item:
+            return _not_found(collection)
+        if expected is not None and expected != int(item.get('version', 0)):
+            return jsonify({'error': 'Version conflict', 'version': int(item.get('version', 0))}), 409
+        if on_delete is not None:
+            on_delete(item)
+        db[collection] = [i for i in db.get(collection, []) if int(i.get('id')) != int(item_id)]
+        _index_drop(collection, item_id)
+    save_db(db)
+    return jsonify({'message': 'Deleted successfully'})
+
+# -----------------------------
+# Sorted field indexes
+# -----------------------------
+
+def _parse_ts(value):
+    """Parse an ISO date/timestamp (incl. trailing Z) into a naive UTC datetime, or None."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        text = str(value).strip()
+        if text.endswith('Z'):
+            text = text[:-1] + '+00:00'
+        try:
+            dt = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _parse_number(value):
+    """Parse an int/float (or numeric string) for numeric indexes; None otherwise."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _start_of_today():
+    return datetime.combine(datetime.now().date(), datetime.min.time())
+
+class _SortedIndex:
+    """Keeps (key, id) pairs of one field sorted so range scans are O(log n + k)."""
+
+    def __init__(self, field, parse):
+        self.field = field
+        self.parse = parse
+        self._entries = []  # sorted [(key, id)]
+        self._keys = {}     # id -> key currently indexed
+
+    def build(self, items):
+        self._keys = {}
+        for item in items:
+            key = self.parse(_raw_field(item, self.field))
+            if key is not None:
+                self._keys[int(item.get('id'))] = key
+        self._entries = sorted((k, i) for i, k in self._keys.items())
+
+    def remove(self, item_id):
+        item_id = int(item_id)
+        key = self._keys.pop(item_id, None)
+        if key is None:
+            return
+        pos = bisect.bisect_left(self._entries, (key, item_id))
+        if pos < len(self._entries) and self._entries[pos] == (key, item_id):
+            del self._entries[pos]
+
+    def put(self, item):
+        item_id = int(item.get('id'))
+        key = self.parse(_raw_field(item, self.field))
+        if self._keys.get(item_id) == key:
+            return
+        self.remove(item_id)
+        if key is not None:
+            self._keys[item_id] = key
+            bisect.insort(self._entries, (key, item_id))
+
+    def _span(self, lo, hi, hi_inclusive):
+        start = 0 if lo is None else bisect.bisect_left(self._entries, (lo,))
+        if hi is None:
+            end = len(self._entries)
+        elif hi_inclusive:
+            end = bisect.bisect_right(self._entries, (hi, math.inf))
+        else:
+            end = bisect.bisect_left(self._entries, (hi,))
+        return start, max(start, end)
+
+    def count(self, lo=None, hi=None, hi_inclusive=False):
+        start, end = self._span(lo, hi, hi_inclusive)
+        return end - start
+
+    def range(self, lo=None, hi=None, reverse=False, hi_inclusive=False):
+        """Yield ids with lo <= key < hi (or <= hi) in key order (either bound optional)."""
+        start, end = self._span(lo, hi, hi_inclusive)
+        span = range(end - 1, start - 1, -1) if reverse else range(start, end)
+        for pos in span:
+            yield self._entries[pos][1]
+
+    def __len__(self):
+        return len(self._entries)
+
+# Fields kept sorted per collection: {collection: {field: parser}}
+INDEXED_FIELDS = {
+    'users': {'created_at': _parse_ts},
+    'medicines': {'created_at': _parse_ts, 'expire_at': _parse_ts, 'current_demand': _parse_number},
+    'wishlists': {'created_at': _parse_ts},
+    'donations': {'created_at': _parse_ts, 'medicine_expires_at': _parse_ts, 'quantity': _parse_number},
+    'grants': {'created_at': _parse_ts},
+    'profiles': {'created_at': _parse_ts},
+    'counters': {'created_at': _parse_ts},
+    'notifications': {'created_at': _parse_ts},
+    'transactions': {'created_at': _parse_ts, 'amount': _parse_number},
+    'micro_grants': {'created_at': _parse_ts},
+    'documents': {'created_at': _parse_ts},
+}
+
+# Field holding the expiry date for collections that support expiry queries
+EXPIRY_FIELDS = {
+    'medicines': 'expire_at',
+    'donations': 'medicine_expires_at',
+}
+
+_INDEXES: _typing.Dict[str, _typing.Dict[str, _SortedIndex]] = {}
+_ROWS: _typing.Dict[str, _typing.Dict[int, dict]] = {}
+
+# Top-level DB keys written since the last snapshot (see create_snapshot)
+_CHANGED_SINCE_SNAPSHOT: _typing.Set[str] = set()
+
+# Derived structures notified of every indexed write; each provides
+# rebuild(db), put(collection, item) and drop(collection, item_id)
+_INDEX_LISTENERS: _typing.List[_typing.Any] = []
+
+def _rebuild_indexes(db):
+    """Rebuild id maps and sorted indexes from a freshly loaded DB."""
+    _INDEXES.clear()
+    _ROWS.clear()
+    # Unknown what changed on disk, so the next snapshot must persist everything
+    _CHANGED_SINCE_SNAPSHOT.update(db.keys())
+    for collection in COLLECTIONS:
+        items = db.get(collection, [])
+        rows = dict(zip(_row_ids(items), items))
+        rows.pop(None, None)
+        _ROWS[collection] = rows
+    for collection, fields in INDEXED_FIELDS.items():
+        rows = _ROWS[collection]
+        _INDEXES[collection] = {}
+        for field, parse in fields.items():
+            index = _SortedIndex(field, parse)
+            index.build(rows.values())
+            _INDEXES[collection][field] = index
+    for listener in _INDEX_LISTENERS:
+        listener.rebuild(db)
+
+def _index_put(collection, item):
+    """Record a created/updated item in its collection's indexes."""
+    _CHANGED_SINCE_SNAPSHOT.add(collection)
+    for listener in _INDEX_LISTENERS:
+        listener.put(collection, item)
+    if collection in _ROWS:
+        _ROWS[collection][int(item.get('id'))] = item
+    for index in _INDEXES.get(collection, {}).values():
+        index.put(item)
+
+def _index_drop(collection, item_id):
+    _CHANGED_SINCE_SNAPSHOT.add(collection)
+    for listener in _INDEX_LISTENERS:
+        listener.drop(collection, item_id)
+    if collection in _ROWS:
+        _ROWS[collection].pop(int(item_id), None)
+    for index in _INDEXES.get(collection, {}).values():
+        index.remove(item_id)
+
+def _index_range(collection, field, lo=None, hi=None, reverse=False):
+    """Items whose indexed field falls in [lo, hi), in field order."""
+    load_db()
+    rows = _ROWS.get(collection, {})
+    return [rows[i] for i in _INDEXES[collection][field].range(lo, hi, reverse=reverse) if i in rows]
+
+def _expiry_bounds_from_args(args):
+    """Parse expires_after/expires_before query args; raises ValueError on bad dates."""
+    bounds = []
+    for name in ('expires_after', 'expires_before'):
+        raw = args.get(name)
+        value = _parse_ts(raw) if raw else None
+        if raw and value is None:
+            raise ValueError(f'{name} must be an ISO date')
+        bounds.append(value)
+    return bounds[0], bounds[1]
+
+def _expired_ids(collection):
+    """Ids whose expiry date is before today."""
+    load_db()
+    field = EXPIRY_FIELDS[collection]
+    return set(_INDEXES[collection][field].range(hi=_start_of_today()))
+
+def _expiring_items(collection):
+    """Serve ?expires_after=&expires_before= from the expiry index, soonest first."""
+    lo, hi = _expiry_bounds_from_args(request.args)
+    return _index_range(collection, EXPIRY_FIELDS[collection], lo=lo, hi=hi)
+
+# Args consumed by list endpoints themselves rather than used as field filters
+_RESERVED_ARGS = {
+    'query', 'expires_after', 'expires_before', 'include_expired', 'days',
+    'sort', 'order', 'since', 'until', 'limit',
+}
+
+def _ordering_from_args(collection, args):
+    """Parse sort/order/since/until/limit query args; raises ValueError on bad input.
+
+    since/until bound the sort field when it is a timestamp index, otherwise
+    created_at; since is inclusive and until exclusive.
+    """
+    order = (args.get('order') or 'asc').lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    bounds = {}
+    for name in ('since', 'until'):
+        raw = args.get(name)
+        bounds[name] = _parse_ts(raw) if raw else None
+        if raw and bounds[name] is None:
+            raise ValueError(f'{name} must be an ISO date or timestamp')
+    limit = args.get('limit')
+    if limit is not None:
+        limit = int(limit) if str(limit).isdigit() else None
+        if limit is None:
+            raise ValueError('limit must be a non-negative integer')
+    field = args.get('sort') or None
+    index = _INDEXES.get(collection, {}).get(field) if field else None
+    time_field = field if index is not None and index.parse is _parse_ts else 'created_at'
+    return {
+        'field': field,
+        'reverse': order == 'desc',
+        'since': bounds['since'],
+        'until': bounds['until'],
+        'time_field': time_field,
+        'limit': limit,
+    }
+
+def _sort_value(value):
+    number = _parse_number(value)
+    return (0, number, '') if number is not None else (1, 0, str(value))
+
+def _query_items(collection, items, args, predicate=None):
+    """Apply sort/order/since/until/limit and an optional row predicate to items.
+
+    When items is the whole collection and the sort (or time) field is
+    indexed, rows are streamed from the sorted index and scanning stops once
+    limit rows match, so "latest N" feeds cost O(log n + k) instead of a sort.
+    """
+    spec = _ordering_from_args(collection, args)
+    field, time_field = spec['field'], spec['time_field']
+    since, until = spec['since'], spec['until']
+    if not field and since is None and until is None and spec['limit'] is None:
+        return [i for i in items if predicate(i)] if predicate else items
+    indexes = _INDEXES.get(collection, {})
+    rows = _ROWS.get(collection, {})
+    index = indexes.get(field or time_field) if (field or since or until) else None
+    # Rows without the sort field keep collection order, flipped for desc
+    ordered = list(reversed(items)) if field and spec['reverse'] else items
+    bounded = False
+    if index is not None and len(items) == len(rows):
+        lo = hi = None
+        if index.field == time_field:
+            lo, hi = since, until
+            bounded = since is not None or until is not None
+        candidates = (rows[i] for i in index.range(lo, hi, reverse=spec['reverse']) if i in rows)
+        if field and not bounded:
+            # Rows lacking the sort field are not indexed; list them last
+            unkeyed = (i for i in ordered if int(i.get('id')) not in index._keys)
+            candidates = itertools.chain(candidates, unkeyed)
+    elif field:
+        if index is not None:
+            keyed = [i for i in items if int(i.get('id')) in index._keys]
+            keyed.sort(key=lambda i: (index._keys[int(i.get('id'))], int(i.get('id'))), reverse=spec['reverse'])
+        else:
+            keyed = [i for i in items if i.get(field) is not None]
+            keyed.sort(key=lambda i: _sort_value(i.get(field)), reverse=spec['reverse'])
+        candidates = keyed + [i for i in ordered if i.get(field) is None]
+    else:
+        candidates = items
+
+    def include(item):
+        if not bounded and (since is not None or until is not None):
+            ts = _parse_ts(_raw_field(item, time_field))
+            if ts is None or (since is not None and ts < since) or (until is not None and ts >= until):
+                return False
+        return predicate is None or predicate(item)
+
+    matched = (i for i in candidates if include(i))
+    if spec['limit'] is not None:
+        matched = itertools.islice(matched, spec['limit'])
+    return list(matched)
+
+# -----------------------------
+# Partitioned storage
+# -----------------------------
+
+# Opt-in: with DB_PARTITIONS=N user-scoped collections are sharded by owner
+# across N partition files next to data.json (data.part0.json, ...) and
+# everything else stays in data.json. The default, 0, keeps the whole DB in
+# data.json. Changing N (including back to 0) migrates on the next save:
+# rows are moved first and partition files beyond N are removed last.
+DB_PARTITIONS = max(0, int(os.getenv('DB_PARTITIONS', '0')))
+PARTITION_KEYS = {
+    'notifications': 'user_id',
+    'wishlists': 'user_id',
+    'counters': 'user_id',
+    'profiles': 'user_id',
+    'donations': 'donor_id',
+}
+GLOBAL_PART = 'global'
+
+_PART_LOCKS: _typing.Dict[_typing.Any, threading.Lock] = {}
+
+def _sharded(collection):
+    """Whether a collection's rows live in partition files rather than data.json."""
+    return DB_PARTITIONS > 0 and collection in PARTITION_KEYS
+
+def _retired(part):
+    """A partition file left beyond DB_PARTITIONS, to be removed once emptied."""
+    return part != GLOBAL_PART and part >= DB_PARTITIONS
+
+def _partition_of(collection, item):
+    """Partition a row is stored in: its owner's shard, or GLOBAL_PART."""
+    if not _sharded(collection):
+        return GLOBAL_PART
+    field = PARTITION_KEYS[collection]
+    owner = item.get(field)
+    key = _as_int(owner)
+    if key is None:
+        key = zlib.crc32(str(owner).encode()) if owner is not None else 0
+    return key % DB_PARTITIONS
+
+def _part_path(part, fmt=None):
+    """File holding a part in the given on-disk format (DB_FORMAT by default)."""
+    base, ext = os.path.splitext(DATA_FILE)
+    if (fmt or DB_FORMAT) == 'binary':
+        ext = BINARY_EXT
+    return base + ext if part == GLOBAL_PART else f'{base}.part{part}{ext}'
+
+def _existing_parts(fmt=None):
+    """Partition numbers with a file on disk, including any beyond DB_PARTITIONS."""
+    base, ext = os.path.splitext(os.path.basename(_part_path(GLOBAL_PART, fmt)))
+    pattern = re.compile(re.escape(base) + r'\.part(\d+)' + re.escape(ext) + '$')
+    try:
+        names = os.listdir(os.path.dirname(DATA_FILE) or '.')
+    except OSError:
+        return []
+    return sorted(int(m.group(1)) for m in map(pattern.match, names) if m)
+
+def _read_json_file(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _read_part(part, fmt=None):
+    """A part's contents from its file in the given format (DB_FORMAT by default).
+
+    None when the file does not exist. Data files left in the other format are
+    never read implicitly (see convert_storage); a binary file that cannot be
+    decoded raises rather than letting an older copy stand in for it.
+    """
+    fmt = fmt or DB_FORMAT
+    path = _part_path(part, fmt)
+    if not os.path.exists(path):
+        other = 'json' if fmt == 'binary' else 'binary'
+        if os.path.exists(_part_path(part, other)):
+            raise RuntimeError(
+                f'{_part_path(part, other)} is not in DB_FORMAT={fmt}; run `python app.py convert` first'
+            )
+        return None
+    if fmt == 'json':
+        return _read_json_file(path)
+    return _read_binary_file(path)
+
+def _row_ids(rows):
+    """Integer ids of rows, None where missing or not numeric."""
+    ids = []
+    for item in rows:
+        if not isinstance(item, (dict, _Record)):
+            ids.append(None)
+            continue
+        item_id = item.get('id')
+        ids.append(item_id if type(item_id) is int else _as_int(item_id))
+    return ids
+
+def _load_partitions(fmt=None):
+    """Read data.json plus the partition files into one DB.
+
+    Returns (db, origins, stamps, stale): origins maps (collection, id) to the
+    part a row was read from, so rows that now route elsewhere (legacy
+    single-file data, a changed DB_PARTITIONS) get rewritten on the next save;
+    stale holds other parts to rewrite. fmt selects the files read
+    (DB_FORMAT by default).
+    """
+    fmt = fmt or DB_FORMAT
+    stamps = {GLOBAL_PART: _file_stamp(_part_path(GLOBAL_PART, fmt))}
+    db = _read_part(GLOBAL_PART, fmt)
+    db = _ensure_db_shape(db if db is not None else copy.deepcopy(DEFAULT_DB), sync_counters=False)
+    counters = db['meta']['counters']
+    origins = {}
+    for collection in PARTITION_KEYS:
+        for item_id in _row_ids(db[collection]):
+            origins[(collection, item_id)] = GLOBAL_PART
+    for part in sorted(set(range(DB_PARTITIONS)) | set(_existing_parts(fmt))):
+        stamps[part] = _file_stamp(_part_path(part, fmt))
+        shard = _read_part(part, fmt)
+        if not isinstance(shard, dict):
+            continue
+        for collection in PARTITION_KEYS:
+            rows = shard.get(collection) or []
+            db[collection].extend(rows)
+            for item_id in _row_ids(rows):
+                origins[(collection, item_id)] = part
+        for collection, value in ((shard.get('meta') or {}).get('counters') or {}).items():
+            counters[collection] = max(int(counters.get(collection, 0)), _as_int(value) or 0)
+    stale = set()
+    for collection in PARTITION_KEYS:
+        rows = db[collection]
+        keyed = sorted(zip(_row_ids(rows), range(len(rows))), key=lambda pair: (pair[0] or 0, pair[1]))
+        rows[:] = [rows[position] for _, position in keyed]
+        ids = [item_id for item_id, _ in keyed if item_id is not None]
+        if len(set(ids)) < len(ids):
+            # data.json left over from before partitioning, not yet rewritten,
+            # still holds rows now kept in a partition; the partition's copy,
+            # read later, wins
+            kept, loose = {}, []
+            for item in rows:
+                item_id = _as_int(item.get('id'))
+                if item_id is None:
+                    loose.append(item)
+                else:
+                    kept[item_id] = item
+            db[collection] = loose + list(kept.values())
+            stale.add(GLOBAL_PART)
+    # Ids in hand-edited JSON may be ahead of the counters; binary files are ours
+    db = _ensure_db_shape(db, sync_counters=fmt == 'json')
+    if 'demand_rollups' not in db:
+        # Derived data: rebuilt until first persisted with data.json
+        _backfill_demand_rollups(db)
+    return db, origins, stamps, stale
+
+class _PartitionRouter:
+    """Routes rows to partitions and tracks which partition files need rewriting.
+
+    Index listener: every write marks its row's partition dirty (and the old one
+    when the owner changed). Each row's JSON is cached until it changes, so
+    rewriting a partition only re-encodes the rows written since.
+    """
+
+    def __init__(self):
+        self.members = {}
+        self.placement = {}
+        self.encoded = {}
+        # Binary-format partition sections by (part, collection), until changed
+        self.sections = {}
+        self.dirty = set()
+        # Parts taken for writing whose file has not been replaced yet
+        self.unwritten = set()
+        # Where rows came from on the last load; None means "unknown, rewrite all"
+        self.origins = None
+
+    def _part(self, part):
+        if part not in self.members:
+            self.members[part] = {collection: {} for collection in PARTITION_KEYS}
+        return self.members[part]
+
+    def rebuild(self, db):
+        origins, self.origins = self.origins, None
+        self.members, self.dirty, self.unwritten = {}, set(), set()
+        parts = set(range(DB_PARTITIONS)) | set(_existing_parts())
+        for part in parts:
+            self._part(part)
+        if origins is None:
+            self.dirty = parts | {GLOBAL_PART}
+        self.placement = {collection: {} for collection in PARTITION_KEYS}
+        self.encoded = {collection: {} for collection in PARTITION_KEYS}
+        self.sections = {}
+        for collection in PARTITION_KEYS:
+            for item in db.get(collection, []):
+                item_id = _as_int(item.get('id'))
+                part = _partition_of(collection, item)
+                if part != GLOBAL_PART:
+                    self.placement[collection][item_id] = part
+                    self._part(part)[collection][item_id] = item
+                if origins is not None:
+                    origin = origins.get((collection, item_id), GLOBAL_PART)
+                    if origin != part:
+                        self.dirty.update((origin, part))
+
+    def put(self, collection, item):
+        if not _sharded(collection):
+            self.dirty.add(GLOBAL_PART)
+            return
+        item_id = int(item.get('id'))
+        part = _partition_of(collection, item)
+        previous = self.placement[collection].get(item_id)
+        if previous is not None and previous != part:
+            self._part(previous)[collection].pop(item_id, None)
+            self.sections.pop((previous, collection), None)
+            self.dirty.add(previous)
+        self.placement[collection][item_id] = part
+        self._part(part)[collection][item_id] = item
+        self.encoded[collection].pop(item_id, None)
+        self.sections.pop((part, collection), None)
+        self.dirty.add(part)
+
+    def drop(self, collection, item_id):
+        if not _sharded(collection):
+            self.dirty.add(GLOBAL_PART)
+            return
+        part = self.placement[collection].pop(int(item_id), None)
+        self.encoded[collection].pop(int(item_id), None)
+        if part is not None:
+            self._part(part)[collection].pop(int(item_id), None)
+            self.sections.pop((part, collection), None)
+            self.dirty.add(part)
+
+    def take(self, db):
+        """Collect the content of dirty partitions; call under the DB lock.
+
+        Returns {part: payload} where payload is a list of string pieces (bytes
+        with DB_FORMAT=binary), or None for a retired part whose file is to be
+        removed; cached row JSON or binary sections make this cheap relative
+        to encoding the rows. Parts stay in unwritten until save_db has
+        replaced their file, so a failed write is retried.
+        """
+        dirty, self.dirty = self.dirty | self.unwritten, set()
+        self.unwritten |= dirty
+        payloads = {}
+        for part in dirty:
+            if _retired(part):
+                payloads[part] = None
+                continue
+            if DB_FORMAT == 'binary':
+                payloads[part] = self._take_binary(db, part)
+                continue
+            if part == GLOBAL_PART:
+                rest = {k: v for k, v in db.items() if not _sharded(k)}
+                payloads[part] = [json.dumps(rest, indent=2, default=_json_default)]
+                continue
+            counters = db['meta']['counters']
+            meta = {'counters': {c: counters.get(c, 0) for c in PARTITION_KEYS}}
+            pieces = ['{\n  "meta": ', json.dumps(meta)]
+            for collection, rows in self._part(part).items():
+                encoded = self.encoded[collection]
+                lines = []
+                for item_id, item in rows.items():
+                    text = encoded.get(item_id)
+                    if text is None:
+                        text = encoded[item_id] = json.dumps(item, default=_json_default)
+                    lines.append(text)
+                pieces.append(f',\n  "{collection}": [')
+                pieces.append(lines)
+                pieces.append(']')
+            pieces.append('\n}\n')
+            payloads[part] = pieces
+        return payloads
+
+    def _take_binary(self, db, part):
+        if part == GLOBAL_PART:
+            return _pack_binary({k: _encode_section(k, v) for k, v in db.items() if not _sharded(k)})
+        counters = db['meta']['counters']
+        sections = {'meta': _encode_section('meta', {'counters': {c: counters.get(c, 0) for c in PARTITION_KEYS}})}
+        for collection, rows in self._part(part).items():
+            section = self.sections.get((part, collection))
+            if section is None:
+                section = self.sections[(part, collection)] = ('rows', _encode_rows(collection, rows.values()))
+            sections[collection] = section
+        return _pack_binary(sections)
+
+_PARTITIONS = _PartitionRouter()
+_INDEX_LISTENERS.append(_PARTITIONS)
+
+def _touch_key(key):
+    """Mark a top-level non-collection key (kept in data.json) as changed."""
+    _CHANGED_SINCE_SNAPSHOT.add(key)
+    _PARTITIONS.dirty.add(GLOBAL_PART)
+
+def _write_part(part, payload):
+    """Atomically replace one partition file with an encoded payload."""
+    path = _part_path(part)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb' if DB_FORMAT == 'binary' else 'w') as f:
+        for piece in payload:
+            if isinstance(piece, list):
+                if piece:
+                    f.write('\n    ' + ',\n    '.join(piece) + '\n  ')
+            else:
+                f.write(piece)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+# -----------------------------
+# Binary storage format
+# -----------------------------
+
+# Opt-in: DB_FORMAT=binary stores data.json and its partitions as data.snap /
+# data.partN.snap instead. Collections are laid out column by column, so
+# loading fills record slots straight from marshalled lists rather than
+# parsing JSON and converting row by row, and a section is only decoded when
+# read. Layout:
+#
+#   BINARY_MAGIC, u32 little-endian header length, header (UTF-8 JSON:
+#   {"version": BINARY_VERSION, "python": "3.x", "sections": {name: [kind,
+#   offset, length]}}), then the section blobs, offsets counted from the end
+#   of the header. kind is "rows" (see _encode_rows), "value" (marshal) or
+#   "json".
+#
+# marshal is only guaranteed readable by the Python version that wrote it
+# (recorded as "python"): export to JSON before upgrading the interpreter.
+# Switching formats is an explicit step, `python app.py convert`, which
+# retires the old files; a file that cannot be decoded is an error, never a
+# reason to fall back to older data.
+DB_FORMAT = 'binary' if os.getenv('DB_FORMAT', 'json').lower() == 'binary' else 'json'
+BINARY_EXT = '.snap'
+BINARY_MAGIC = b'MEDSNAP1'
+BINARY_VERSION = 1
+CONVERTED_SUFFIX = '.converted'
+
+def _encode_rows(collection, rows):
+    """Column-wise encoding of a collection's records.
+
+    Each column is (field, positions or None for every row, values, as_datetime);
+    timestamps held as datetimes are stored as ISO strings in a column of their
+    own. Fields outside the record's slots are stored per row.
+    """
+    cls = _RECORD_CLASSES[collection]
+    records = [item if type(item) is cls else cls(item) for item in rows if isinstance(item, (dict, _Record))]
+    n = len(records)
+    columns = []
+    for field, slot in cls._slot_of.items():
+        values = [getattr(record, slot, _MISSING) for record in records]
+        present = [i for i, value in enumerate(values) if value is not _MISSING]
+        if not present:
+            continue
+        if len(present) < n:
+            values = [values[i] for i in present]
+        else:
+            present = None
+        if field in TIMESTAMP_FIELDS:
+            positions = range(n) if present is None else present
+            dated = [(i, v) for i, v in zip(positions, values) if type(v) is datetime]
+            if dated:
+                columns.append((field, [i for i, _ in dated], [v.isoformat() for _, v in dated], True))
+                if len(dated) == len(values):
+                    continue
+                rest = [(i, v) for i, v in zip(positions, values) if type(v) is not datetime]
+                present, values = [i for i, _ in rest], [v for _, v in rest]
+        columns.append((field, present, values, False))
+    extra_positions = [i for i, record in enumerate(records) if record._extra]
+    extras = [records[i]._extra for i in extra_positions]
+    return marshal.dumps((n, columns, extra_positions, extras))
+
+def _decode_rows(collection, blob):
+    """Records from _encode_rows output, tolerating fields added or removed since."""
+    n, columns, extra_positions, extras = marshal.loads(blob)
+    cls = _RECORD_CLASSES[collection]
+    slot_of = cls._slot_of
+    records = [cls.__new__(cls) for _ in range(n)]
+    for record in records:
+        record._extra = None
+    for position, extra in zip(extra_positions, extras):
+        record = records[position]
+        if slot_of.keys().isdisjoint(extra):
+            record._extra = extra
+        else:
+            record.update(extra)
+    for field, positions, values, as_datetime in columns:
+        targets = records if positions is None else [records[i] for i in positions]
+        if as_datetime:
+            values = [datetime.fromisoformat(value) for value in values]
+        slot = slot_of.get(field)
+        if slot is None:
+            for record, value in zip(targets, values):
+                record[field] = value
+        else:
+            for record, value in zip(targets, values):
+                setattr(record, slot, value)
+    return records
+
+def _encode_section(name, value):
+    """(kind, blob) for one top-level key."""
+    if name in _RECORD_CLASSES and isinstance(value, list):
+        return 'rows', _encode_rows(name, value)
+    try:
+        return 'value', marshal.dumps(value)
+    except ValueError:
+        return 'json', json.dumps(value, default=_json_default).encode()
+
+def _pack_binary(sections):
+    """File pieces for {name: (kind, blob)}: magic, directory, then the blobs."""
+    directory, offset = {}, 0
+    for name, (kind, blob) in sections.items():
+        directory[name] = [kind, offset, len(blob)]
+        offset += len(blob)
+    header = json.dumps({
+        'version': BINARY_VERSION,
+        'python': '%d.%d' % sys.version_info[:2],
+        'sections': directory,
+    }).encode()
+    return [BINARY_MAGIC, struct.pack('<I', len(header)), header] + [blob for _, blob in sections.values()]
+
+class _BinaryFile:
+    """A binary part file, memory-mapped; sections are decoded on read()."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self.data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+                raise ValueError(f'{path} is not a binary data file')
+            start = len(BINARY_MAGIC) + 4
+            (size,) = struct.unpack_from('<I', self.data, len(BINARY_MAGIC))
+            header = json.loads(self.data[start:start + size])
+            if header.get('version') != BINARY_VERSION:
+                raise ValueError(f"{path} has binary format version {header.get('version')}, expected {BINARY_VERSION}")
+            self.python = header.get('python')
+            self.sections = header['sections']
+            self.base = start + size
+            if self.base + sum(length for _, _, length in self.sections.values()) > len(self.data):
+                raise ValueError(f'{path} is truncated')
+        except Exception:
+            self.close()
+            raise
+
+    def names(self):
+        return list(self.sections)
+
+    def read(self, name, default=None):
+        entry = self.sections.get(name)
+        if entry is None:
+            return default
+        kind, offset, length = entry
+        blob = self.data[self.base + offset:self.base + offset + length]
+        if kind == 'rows':
+            return _decode_rows(name, blob)
+        if kind == 'json':
+            return json.loads(blob)
+        return marshal.loads(blob)
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _read_binary_file(path, names=None):
+    """Decode a binary part file (only the named sections, if given).
+
+    Raises ValueError if the file cannot be decoded.
+    """
+    try:
+        with _BinaryFile(path) as f:
+            try:
+                return {name: f.read(name) for name in (f.names() if names is None else names) if name in f.sections}
+            except (ValueError, EOFError, TypeError, KeyError, IndexError) as exc:
+                raise ValueError(f'{path} (written by Python {f.python}) cannot be decoded: {exc}') from exc
+    except (KeyError, struct.error, json.JSONDecodeError) as exc:
+        raise ValueError(f'{path} has a malformed header: {exc}') from exc
+
+def convert_storage():
+    """Rewrite the data files from the other format into DB_FORMAT, once.
+
+    Everything is read from the other format's files and saved in DB_FORMAT;
+    the old files are then renamed with CONVERTED_SUFFIX so they are never read
+    again. Refuses to run when DB_FORMAT files already exist. Returns the
+    retired paths.
+    """
+    other = 'json' if DB_FORMAT == 'binary' else 'binary'
+    with _DB_LOCK:
+        existing = [GLOBAL_PART] + _existing_parts(DB_FORMAT)
+        if any(os.path.exists(_part_path(part)) for part in existing):
+            raise RuntimeError(f'{DB_FORMAT} data files already exist; nothing to convert')
+        old = [_part_path(part, other) for part in [GLOBAL_PART] + _existing_parts(other)]
+        old = [path for path in old if os.path.exists(path)]
+        if not old:
+            return []
+        db, _, _, _ = _load_partitions(other)
+    # A new DB object with unknown origins: save_db rebuilds the indexes and
+    # writes every part
+    _PARTITIONS.origins = None
+    save_db(db)
+    for path in old:
+        os.replace(path, path + CONVERTED_SUFFIX)
+    return old
+
+def export_json(path):
+    """Write the whole DB as one JSON document shaped like data.json."""
+    with _DB_LOCK:
+        db = load_db()
+        frozen = _freeze_collections(db, list(db.keys()))
+    _write_json_atomic(path, frozen, indent=2)
+
+# -----------------------------
+# Change feed
+# -----------------------------
+
+# Changed keys kept for incremental sync; older entries are compacted away
+CHANGE_LOG_LIMIT = int(os.getenv('CHANGE_LOG_LIMIT', '10000'))
+CHANGE_WAIT_MAX = 30
+
+class _ChangeLog:
+    """Compacted change-data-capture log: the latest change per (collection, id).
+
+    Index listener. Every insert/update/delete gets the next global sequence
+    number and moves its key to the end, so the log stays in seq order and a
+    read since <seq> walks back only over newer entries. Sequence numbers
+    start from the wall clock in microseconds, so they keep increasing across
+    restarts; anything at or before min_seq (startup, reload from disk, or
+    entries evicted past CHANGE_LOG_LIMIT) can only be recovered by a full
+    resync, which readers are told via reset.
+    """
+
+    def __init__(self, limit=CHANGE_LOG_LIMIT):
+        self.limit = limit
+        self.entries = OrderedDict()
+        self.seq = time.time_ns() // 1000
+        self.min_seq = self.seq
+        self._cond = threading.Condition()
+
+    def _record(self, collection, item_id, op, item=None):
+        with self._cond:
+            self.seq += 1
+            key = (collection, item_id)
+            self.entries.pop(key, None)
+            self.entries[key] = (self.seq, op, item)
+            while len(self.entries) > self.limit:
+                _, (seq, _, _) = self.entries.popitem(last=False)
+                self.min_seq = max(self.min_seq, seq)
+            self._cond.notify_all()
+
+    # Index listener protocol
+    def rebuild(self, db):
+        with self._cond:
+            # Unknown what changed on disk: every reader must resync
+            self.entries.clear()
+            self.seq += 1
+            self.min_seq = self.seq
+            self._cond.notify_all()
+
+    def put(self, collection, item):
+        item_id = int(item.get('id'))
+        # Listeners run before _ROWS is updated, so a known id is an update
+        op = 'update' if item_id in _ROWS.get(collection, {}) else 'insert'
+        self._record(collection, item_id, op, item)
+
+    def drop(self, collection, item_id):
+        self._record(collection, int(item_id), 'delete')
+
+    def since(self, seq, collections=None, limit=500, wait=0):
+        """Changes after seq, oldest first: (changes, last_seq, reset).
+
+        With wait > 0 and nothing new, blocks up to wait seconds for a change.
+        """
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while True:
+                if seq < self.min_seq:
+                    return [], self.seq, True
+                head = self.seq
+                newer = []
+                for key, entry in reversed(self.entries.items()):
+                    if entry[0] <= seq:
+                        break
+                    if collections is None or key[0] in collections:
+                        newer.append((key, entry))
+                remaining = deadline - time.monotonic()
+                if newer or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        newer.reverse()
+        newer = newer[:limit]
+        changes = []
+        with _DB_LOCK:
+            for (collection, item_id), (entry_seq, op, item) in newer:
+                change = {'seq': entry_seq, 'collection': collection, 'op': op, 'id': item_id}
+                if item is not None:
+                    change['item'] = dict(item)
+                changes.append(change)
+        last_seq = changes[-1]['seq'] if len(newer) == limit else max(seq, head)
+        return changes, last_seq, False
+
+_CHANGES = _ChangeLog()
+_INDEX_LISTENERS.append(_CHANGES)
+
+@app.route('/api/changes', methods=['GET'])
+def list_changes():
+    """Inserts/updates/deletes after ?since=<seq> (?collections=a,b, ?limit=, ?wait= seconds to long-poll).
+
+    Returns the latest change per record in seq order and last_seq to pass as
+    the next since. reset=true means the history is gone: reload full lists.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = max(1, min(int(request.args.get('limit', 500)), 5000))
+        wait = max(0.0, min(float(request.args.get('wait', 0)), CHANGE_WAIT_MAX))
+    except ValueError:
+        return jsonify({'error': 'since, limit and wait must be numbers'}), 400
+    names = request.args.get('collections')
+    selected = None
+    if names:
+        selected = {_collection_from_path(n.strip()) for n in names.split(',') if n.strip()}
+        if None in selected:
+            return jsonify({'error': 'Unknown collection in collections'}), 400
+    load_db()
+    changes, last_seq, reset = _CHANGES.since(since, selected, limit=limit, wait=wait)
+    return jsonify({'changes': changes, 'last_seq': last_seq, 'min_seq': _CHANGES.min_seq, 'reset': reset})
+
+# -----------------------------
+# Query filters
+# -----------------------------
+
+# ?field=value is equality; ?field__op=value selects another operator
+FILTER_OPS = ('eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'in', 'contains', 'exists')
+
+_FLAGS = {'true': True, 'false': False}
+
+def _equals(raw):
+    """Compile a typed equality test against a query-string value.
+
+    The value is parsed once; rows are compared by their own type (strings
+    exactly, numbers numerically, booleans as true/false, None as None/null)
+    instead of stringifying every row.
+    """
+    number = _parse_number(raw)
+    flag = _FLAGS.get(raw.lower())
+    is_null = raw in ('None', 'null')
+
+    def test(value):
+        if isinstance(value, str):
+            return value == raw
+        if isinstance(value, bool):
+            return value is flag
+        if isinstance(value, (int, float)):
+            return number is not None and value == number
+        if value is None:
+            return is_null
+        return str(value) == raw
+    return test
+
+def _member_of(raws):
+    """Compile a membership test for ?field__in=a,b,c."""
+    strings = set(raws)
+    numbers = {n for n in map(_parse_number, raws) if n is not None}
+    flags = {_FLAGS[r.lower()] for r in raws if r.lower() in _FLAGS}
+    is_null = bool(strings & {'None', 'null'})
+
+    def test(value):
+        if isinstance(value, str):
+            return value in strings
+        if isinstance(value, bool):
+            return value in flags
+        if isinstance(value, (int, float)):
+            return value in numbers
+        if value is None:
+            return is_null
+        return str(value) in strings
+    return test
+
+def _ordering_key(collection, field, raw):
+    """(row -> comparable key, bound) for lt/lte/gt/gte on field.
+
+    Indexed fields reuse the index's parsed keys; otherwise the bound's own
+    type decides whether rows compare as numbers, timestamps or strings.
+    """
+    index = _INDEXES.get(collection, {}).get(field)
+    if index is not None:
+        bound = index.parse(raw)
+        if bound is None:
+            raise ValueError(f'{field} filter value {raw!r} is not comparable')
+        keys = index._keys
+        return (lambda item: keys.get(int(item.get('id')))), bound
+    bound = _parse_number(raw)
+    if bound is not None:
+        return (lambda item: _parse_number(item.get(field))), bound
+    bound = _parse_ts(raw)
+    if bound is not None:
+        return (lambda item: _parse_ts(_raw_field(item, field))), bound
+    return (lambda item: item.get(field) if isinstance(item.get(field), str) else None), raw
+
+_COMPARE = {
+    'lt': lambda key, bound: key < bound,
+    'lte': lambda key, bound: key <= bound,
+    'gt': lambda key, bound: key > bound,
+    'gte': lambda key, bound: key >= bound,
+}
+
+def _compile_condition(collection, field, op, raw):
+    """Compile one field/operator/value triple into a row predicate."""
+    if op in ('eq', 'ne'):
+        test = _equals(raw)
+        if op == 'ne':
+            return lambda item: not test(item.get(field))
+        return lambda item: test(item.get(field))
+    if op == 'in':
+        test = _member_of([r for r in raw.split(',') if r != ''])
+        return lambda item: test(item.get(field))
+    if op == 'contains':
+        needle = raw.lower()
+        element = _equals(raw)
+
+        def contains(item):
+            value = item.get(field)
+            if isinstance(value, str):
+                return needle in value.lower()
+            if isinstance(value, (list, tuple)):
+                return any(element(v) for v in value)
+            return False
+        return contains
+    if op == 'exists':
+        wanted = _FLAGS.get(raw.lower(), {'1': True, '0': False}.get(raw))
+        if wanted is None:
+            raise ValueError(f'{field}__exists must be true or false')
+        return lambda item: (item.get(field) is not None) is wanted
+    key, bound = _ordering_key(collection, field, raw)
+    compare = _COMPARE[op]
+
+    def ordered(item):
+        value = key(item)
+        if value is None:
+            return False
+        try:
+            return compare(value, bound)
+        except TypeError:
+            return False
+    return ordered
+
+class _CompiledFilter:
+    """Query-arg filters parsed once into a single row predicate plus an index plan."""
+
+    def __init__(self, collection, args):
+        self.collection = collection
+        self.conditions = []
+        # (field, lo, hi, hi_inclusive) ranges an index can serve
+        self._ranges = []
+        for name, raw in args.items():
+            if name in _RESERVED_ARGS:
+                continue
+            field, _, op = name.partition('__')
+            op = op or 'eq'
+            if op not in FILTER_OPS:
+                raise ValueError(f"Unknown filter operator '{op}' (use one of {', '.join(FILTER_OPS)})")
+            self.conditions.append(_compile_condition(collection, field, op, raw))
+            self._plan_range(field, op, raw)
+
+    def _plan_range(self, field, op, raw):
+        index = _INDEXES.get(self.collection, {}).get(field)
+        if index is None or op not in ('eq', 'lt', 'lte', 'gt', 'gte'):
+            return
+        bound = index.parse(raw)
+        if bound is None:
+            return
+        if op == 'eq':
+            self._ranges.append((field, bound, bound, True))
+        elif op in ('gt', 'gte'):
+            self._ranges.append((field, bound, None, False))
+        else:
+            self._ranges.append((field, None, bound, op == 'lte'))
+
+    @property
+    def predicate(self):
+        conditions = self.conditions
+        if not conditions:
+            return None
+        if len(conditions) == 1:
+            return conditions[0]
+        return lambda item: all(test(item) for test in conditions)
+
+    def candidates(self, items):
+        """Narrow items via the most selective indexed range when items is the whole collection."""
+        rows = _ROWS.get(self.collection, {})
+        if not self._ranges or len(items) != len(rows):
+            return items
+        indexes = _INDEXES[self.collection]
+        best = None
+        for field, lo, hi, inclusive in self._ranges:
+            size = indexes[field].count(lo, hi, hi_inclusive=inclusive)
+            if best is None or size < best[0]:
+                best = (size, field, lo, hi, inclusive)
+        size, field, lo, hi, inclusive = best
+        if size >= len(items):
+            return items
+        ids = indexes[field].range(lo, hi, hi_inclusive=inclusive)
+        return [rows[i] for i in sorted(ids) if i in rows]
+
+def _filter_items(collection, items, args, predicate=None):
+    """Apply typed query-arg filters and sort/order/limit; raises ValueError on bad args.
+
+    predicate is an extra row test checked with the filters, so unlike
+    pre-filtering items it keeps the index plans for the whole collection.
+    """
+    compiled = _CompiledFilter(collection, args)
+    if predicate is not None:
+        compiled.conditions.append(predicate)
+    return _query_items(collection, compiled.candidates(items), args, predicate=compiled.predicate)
+
+def _list_expiring(collection, exclude=None):
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}), 400
+    today = _start_of_today()
+    items = _index_range(collection, EXPIRY_FIELDS[collection], lo=today, hi=today + timedelta(days=days + 1))
+    if exclude is not None:
+        items = [i for i in items if not exclude(i)]
+    return jsonify(_rows_snapshot(items))
+
+# -----------------------------
+# Expired donation sweep
+# -----------------------------
+
+EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', '3600'))
+
+def sweep_expired_donations():
+    """Flag unclaimed donations past their expiry and notify each donor in one batch.
+
+    Returns the donations flagged by this run; all changes land in a single save.
+    """
+    with _DB_LOCK:
+        db = load_db()
+        now = datetime.now().isoformat()
+        flagged = []
+        for donation in _index_range('donations', 'medicine_expires_at', hi=_start_of_today()):
+            if donation.get('expired') or donation.get('claimed_by'):
+                continue
+            donation['expired'] = True
+            donation['expired_flagged_at'] = now
+            _touch('donations', donation)
+            flagged.append(donation)
+        if not flagged:
+            return []
+        by_donor: _typing.Dict[_typing.Any, _typing.List[dict]] = {}
+        for donation in flagged:
+            if donation.get('donor_id') is not None:
+                by_donor.setdefault(donation.get('donor_id'), []).append(donation)
+        for donor_id, donations in by_donor.items():
+            names = ', '.join(d.get('medicine_name') or f"donation #{d.get('id')}" for d in donations)
+            _insert_item(db, 'notifications', {
+                'user_id': donor_id,
+                'type': 'donation',
+                'title': 'Donation Expired',
+                'message': f"Your donation of {names} has expired and is no longer listed.",
+                'read': False,
+            })
+    save_db(db)
+    return flagged
+
+def _expiry_sweeper():
+    while True:
+        try:
+            sweep_expired_donations()
+        except Exception:
+            pass
+        time.sleep(EXPIRY_SWEEP_INTERVAL)
+
+def start_background_tasks():
+    """Start periodic maintenance threads (expired-donation sweep) and replay queued side effects."""
+    threading.Thread(target=_expiry_sweeper, name='expiry-sweeper', daemon=True).start()
+    _SIDE_EFFECTS.start()
+
+# -----------------------------
+# Donation ↔ wishlist matching
+# -----------------------------
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class _LazyHeap:
+    """Min-heap of entries whose last element is an item id, with lazy deletion.
+
+    Superseded entries stay in the heap and are skipped when popped; the heap is
+    rebuilt from live entries once stale ones dominate, keeping writes O(log n).
+    """
+
+    def __init__(self):
+        self.heap: list = []
+        self.live: _typing.Dict[int, tuple] = {}  # id -> current entry
+
+    def push(self, entry):
+        if self.live.get(entry[-1]) == entry:
+            return
+        self.live[entry[-1]] = entry
+        heapq.heappush(self.heap, entry)
+
+    def discard(self, item_id):
+        if self.live.pop(item_id, None) is not None and len(self.heap) > 2 * len(self.live) + 64:
+            self.heap = list(self.live.values())
+            heapq.heapify(self.heap)
+
+    def top(self, limit):
+        """Up to `limit` live entries in priority order, left in the heap."""
+        taken = []
+        seen = set()
+        while self.heap and len(taken) < limit:
+            entry = heapq.heappop(self.heap)
+            # Skip superseded entries and duplicates left by discard-then-push
+            if self.live.get(entry[-1]) == entry and entry[-1] not in seen:
+                seen.add(entry[-1])
+                taken.append(entry)
+        for entry in taken:
+            heapq.heappush(self.heap, entry)
+        return taken
+
+    def __len__(self):
+        return len(self.live)
+
+def _is_open_request(item):
+    """A wishlist request still counts towards demand until rejected or fulfilled."""
+    return not item.get('rejected_at') and not item.get('fulfilled')
+
+class _MatchEngine:
+    """Per-medicine priority queues of open wishlist requests and available donations.
+
+    Kept current from the index write hooks, so each wishlist/donation write costs
+    O(log n) and suggestions never rescan the collections.
+    """
+
+    def __init__(self):
+        self._requests: _typing.Dict[int, _LazyHeap] = {}  # medicine_id -> (rank, created, id)
+        self._stock: _typing.Dict[int, _LazyHeap] = {}     # medicine_id -> (expiry, id)
+        self._request_med: _typing.Dict[int, int] = {}     # wishlist id -> medicine_id
+        self._stock_med: _typing.Dict[int, tuple] = {}     # donation id -> (medicine_id, quantity)
+        self._available_qty: _typing.Dict[int, int] = {}
+
+    @staticmethod
+    def _request_key(item):
+        """Open wishlists rank approved-first, then oldest; None once rejected/fulfilled."""
+        med_id = _as_int(item.get('medicine_id'))
+        if med_id is None or not _is_open_request(item):
+            return None, None
+        created = _parse_ts(_raw_field(item, 'created_at')) or datetime.max
+        return med_id, (0 if item.get('approved') is True else 1, created, int(item.get('id')))
+
+    @staticmethod
+    def _stock_key(item):
+        """Available donations rank soonest-expiring first; None once claimed or expired."""
+        med_id = _as_int(item.get('medicine_id'))
+        if med_id is None or item.get('claimed_by') or item.get('expired'):
+            return None, None
+        expiry = _parse_ts(item.get('medicine_expires_at'))
+        if expiry is not None and expiry < _start_of_today():
+            return None, None
+        return med_id, (expiry or datetime.max, int(item.get('id')))
+
+    # Index listener protocol
+
+    def rebuild(self, db):
+        self.__init__()
+        for item in db.get('wishlists', []):
+            self.put('wishlists', item)
+        for item in db.get('donations', []):
+            self.put('donations', item)
+
+    def put(self, collection, item):
+        if collection == 'wishlists':
+            item_id = int(item.get('id'))
+            med_id, key = self._request_key(item)
+            if self._request_med.get(item_id) not in (None, med_id) or key is None:
+                self.drop(collection, item_id)
+            if key is not None:
+                self._request_med[item_id] = med_id
+                self._requests.setdefault(med_id, _LazyHeap()).push(key)
+        elif collection == 'donations':
+            item_id = int(item.get('id'))
+            med_id, key = self._stock_key(item)
+            qty = _as_int(item.get('quantity')) or 0
+            self.drop(collection, item_id)
+            if key is not None:
+                self._stock_med[item_id] = (med_id, qty)
+                self._available_qty[med_id] = self._available_qty.get(med_id, 0) + qty
+                self._stock.setdefault(med_id, _LazyHeap()).push(key)
+
+    def drop(self, collection, item_id):
+        item_id = int(item_id)
+        if collection == 'wishlists':
+            med_id = self._request_med.pop(item_id, None)
+            if med_id is not None:
+                self._requests[med_id].discard(item_id)
+        elif collection == 'donations':
+            current = self._stock_med.pop(item_id, None)
+            if current is not None:
+                med_id, qty = current
+                self._available_qty[med_id] -= qty
+                self._stock[med_id].discard(item_id)
+
+    # Queries
+
+    def suggest(self, medicine_id=None, limit=20):
+        """Pair the highest-priority open requests with the soonest-expiring donations."""
+        if medicine_id is not None:
+            med_ids = [medicine_id]
+        else:
+            med_ids = [m for m, q in self._requests.items() if len(q) and len(self._stock.get(m, ()))]
+        matches = []
+        for med_id in med_ids:
+            remaining = limit - len(matches)
+            if remaining <= 0:
+                break
+            stock = self._stock.get(med_id)
+            queue = self._requests.get(med_id)
+            if not stock or not queue:
+                continue
+            donations = stock.top(remaining)
+            requests = queue.top(len(donations))
+            for req, don in zip(requests, donations):
+                matches.append({'medicine_id': med_id, 'wishlist_id': req[-1], 'donation_id': don[-1]})
+        return matches
+
+    def open_request(self, medicine_id, user_id):
+        """A user's highest-priority open wishlist row for a medicine, or None."""
+        queue = self._requests.get(_as_int(medicine_id))
+        rows = _ROWS.get('wishlists', {})
+        for entry in sorted(queue.live.values()) if queue else ():
+            item = rows.get(entry[-1])
+            if item is not None and _as_int(item.get('user_id')) == _as_int(user_id):
+                return item
+        return None
+
+    def summary(self, medicine_id):
+        return {
+            'medicine_id': medicine_id,
+            'open_requests': len(self._requests.get(medicine_id, ())),
+            'available_quantity': self._available_qty.get(medicine_id, 0),
+        }
+
+_MATCHER = _MatchEngine()
+_INDEX_LISTENERS.append(_MATCHER)
+
+@app.route('/api/matches', methods=['GET'])
+def list_matches():
+    """Suggested donation → wishlist matches (?medicine_id=, ?limit=, default 20)."""
+    medicine_id = request.args.get('medicine_id')
+    try:
+        limit = int(request.args.get('limit', 20))
+        medicine_id = int(medicine_id) if medicine_id else None
+    except ValueError:
+        return jsonify({'error': 'medicine_id and limit must be integers'}), 400
+    with _DB_LOCK:
+        load_db()
+        matches = _MATCHER.suggest(medicine_id, limit=limit)
+    wishlists = _ROWS.get('wishlists', {})
+    donations = _ROWS.get('donations', {})
+    for match in matches:
+        wishlist = wishlists.get(match['wishlist_id']) or {}
+        donation = donations.get(match['donation_id']) or {}
+        match.update({
+            'user_id': wishlist.get('user_id'),
+            'approved': wishlist.get('approved') is True,
+            'donor_id': donation.get('donor_id'),
+            'quantity': donation.get('quantity'),
+            'medicine_expires_at': donation.get('medicine_expires_at'),
+        })
+    response = {'matches': matches}
+    if medicine_id is not None:
+        response.update(_MATCHER.summary(medicine_id))
+    return jsonify(response)
+
+# -----------------------------
+# Background side effects
+# -----------------------------
+
+SIDE_EFFECT_JOURNAL = os.getenv('SIDE_EFFECT_JOURNAL') or os.path.join(os.path.dirname(__file__), 'side_effects.jsonl')
+SIDE_EFFECT_WORKERS = int(os.getenv('SIDE_EFFECT_WORKERS', '1'))
+SIDE_EFFECT_BATCH = 100
+SIDE_EFFECT_MAX_ATTEMPTS = 5
+# Longest wait before retrying a batch whose save failed
+SIDE_EFFECT_MAX_BACKOFF = 30
+
+# kind -> handler(db, **args); handlers mutate the loaded DB and never save
+_SIDE_EFFECT_HANDLERS: _typing.Dict[str, _typing.Callable] = {}
+
+def _side_effect(kind):
+    def register(handler):
+        _SIDE_EFFECT_HANDLERS[kind] = handler
+        return handler
+    return register
+
+@_side_effect('notify')
+def _apply_notify(db, payload):
+    _insert_item(db, 'notifications', payload, defaults={'read': False})
+
+
+class _SideEffectQueue:
+    """Durable in-process queue that applies side effects in batches on worker threads.
+
+    Tasks are journaled before the request responds and acknowledged once the
+    batch that applied them has been saved, so pending work is replayed after
+    a crash. Failing tasks, and batches whose save fails, are retried with
+    exponential backoff. The sequence numbers of applied tasks are saved in
+    db['meta'] along with their effects, so a task replayed after a crash
+    between that save and its acknowledgement is not applied twice. (The meta
+    lives in data.json, written last: a notification saved to its partition
+    just before such a crash can still be repeated.)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._cond = threading.Condition()
+        self._pending: deque = deque()
+        self._in_flight: _typing.Set[int] = set()
+        self._seq = 0
+        self._loaded = False
+        self._started = False
+        self._stopping = False
+        self._threads: _typing.List[threading.Thread] = []
+
+    def _load(self):
+        """Replay unacknowledged tasks from the journal (called with the lock held)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        # Wall-clock based, so sequence numbers stay unique after the journal is
+        # truncated and across restarts (they are remembered in the DB)
+        self._seq = max(self._seq, int(time.time() * 1_000_000))
+        tasks, done = {}, set()
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from a crash
+                    if 'done' in record:
+                        done.update(record['done'])
+                    else:
+                        tasks[record['seq']] = record
+        except OSError:
+            return
+        self._seq = max(self._seq, max(tasks, default=0))
+        self._pending.extend(tasks[seq] for seq in sorted(tasks) if seq not in done)
+
+    def _journal(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self):
+        """Run the workers in this process, which from then on owns the journal."""
+        with self._cond:
+            if not self._started:
+                self._started = True
+                atexit.register(self.shutdown)
+            self._load()
+            self._stopping = False
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < SIDE_EFFECT_WORKERS:
+                thread = threading.Thread(target=self._worker, name='side-effects', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._cond.notify_all()
+
+    def put(self, kind, **args):
+        """Journal a side effect and hand it to the workers."""
+        with self._cond:
+            self._load()
+            self._seq += 1
+            task = {'seq': self._seq, 'kind': kind, 'args': args, 'attempts': 0}
+            self._journal(task)
+            self._pending.append(task)
+            self._cond.notify()
+        if not self._threads:
+            self.start()
+
+    def _take_batch(self, force=False):
+        """Pop up to SIDE_EFFECT_BATCH tasks that are due (lock held)."""
+        now = time.monotonic()
+        batch, deferred = [], []
+        while self._pending and len(batch) < SIDE_EFFECT_BATCH:
+            task = self._pending.popleft()
+            (batch if force or task.get('not_before', 0) <= now else deferred).append(task)
+        self._pending.extendleft(reversed(deferred))
+        self._in_flight.update(task['seq'] for task in batch)
+        return batch
+
+    def _apply(self, batch):
+        applied, retry = [], []
+        try:
+            with _DB_LOCK:
+                db = load_db()
+                recorded = db['meta'].setdefault('side_effects_applied', [])
+                already = set(recorded)
+                for task in batch:
+                    if task['seq'] in already:
+                        # Applied before a failed save or a crash; only the ack is missing
+                        applied.append(task)
+                        continue
+                    try:
+                        _SIDE_EFFECT_HANDLERS[task['kind']](db, **task['args'])
+                        applied.append(task)
+                    except Exception as e:
+                        task['attempts'] = task.get('attempts', 0) + 1
+                        if task['attempts'] < SIDE_EFFECT_MAX_ATTEMPTS:
+                            task['not_before'] = time.monotonic() + 0.5 * 2 ** task['attempts']
+                            retry.append(task)
+                        else:
+                            app.logger.warning('Dropping side effect %s after %s attempts: %s', task['kind'], task['attempts'], e)
+                            applied.append(task)
+                if applied:
+                    with self._cond:
+                        # Anything older than every outstanding task is acknowledged
+                        floor = min(itertools.chain(self._in_flight, (t['seq'] for t in self._pending)))
+                    recorded[:] = [seq for seq in recorded if seq >= floor]
+                    recorded.extend(task['seq'] for task in applied if task['seq'] not in already)
+                    _touch_key('meta')
+            if applied:
+                save_db(db)
+        except Exception as e:
+            # Not saved: keep every task queued (and unacknowledged, so a
+            # restart replays them); effects already applied in memory are
+            # skipped by seq when the batch comes round again
+            app.logger.warning('Saving side effects failed, retrying: %s', e)
+            now = time.monotonic()
+            for task in batch:
+                task['save_failures'] = task.get('save_failures', 0) + 1
+                delay = min(SIDE_EFFECT_MAX_BACKOFF, 0.5 * 2 ** task['save_failures'])
+                task['not_before'] = max(task.get('not_before', 0), now + delay)
+            applied, retry = [], list(batch)
+        with self._cond:
+            self._in_flight.difference_update(task['seq'] for task in batch)
+            if applied:
+                self._journal({'done': [task['seq'] for task in applied]})
+            self._pending.extend(retry)
+            if not self._pending and not self._in_flight:
+                # Everything acknowledged: start a fresh journal
+                open(self.path, 'w').close()
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                batch = self._take_batch()
+                if not batch:
+                    # Only backed-off retries remain
+                    self._cond.wait(timeout=0.5)
+                    continue
+            self._apply(batch)
+
+    def drain(self, timeout=None):
+        """Apply everything queued, including backed-off retries; True when empty."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if not self._started:
+                    # The journal belongs to the process running the workers
+                    # (e.g. the server while a CLI command runs); leave it be
+                    return True
+                if not self._pending and not self._in_flight:
+                    return True
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                batch = self._take_batch(force=True)
+                if not batch:
+                    self._cond.wait(timeout=0.05)
+                    continue
+            self._apply(batch)
+
+    def shutdown(self, timeout=30):
+        """Stop the workers and apply whatever is still queued (registered at exit by start)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+        return self.drain(timeout=timeout)
+
+_SIDE_EFFECTS = _SideEffectQueue(SIDE_EFFECT_JOURNAL)
+
+def _notify(payload):
+    """Queue a notification instead of writing it on the request path."""
+    _SIDE_EFFECTS.put('notify', payload=payload)
+
+# -----------------------------
+# Demand analytics
+# -----------------------------
+
+# Per-medicine counters kept in db['demand_rollups'][grain][bucket][medicine_id],
+# in this order
+DEMAND_EVENTS = ('requests', 'approvals', 'rejections', 'fulfilled')
+DEMAND_BUCKETS = {'hour': '%Y-%m-%dT%H', 'day': '%Y-%m-%d'}
+DEMAND_RETENTION = {'hour': timedelta(days=14), 'day': timedelta(days=730)}
+# Windows up to this long are answered from hourly buckets
+HOURLY_WINDOW_MAX = timedelta(hours=48)
+
+def _record_demand(db, medicine_id, event, at, count=1):
+    """Add count to the hourly and daily buckets of a medicine's event counter."""
+    rollups = db.setdefault('demand_rollups', {})
+    slot = DEMAND_EVENTS.index(event)
+    for grain, fmt in DEMAND_BUCKETS.items():
+        buckets = rollups.setdefault(grain, {})
+        key = at.strftime(fmt)
+        if key not in buckets:
+            cutoff = (datetime.now() - DEMAND_RETENTION[grain]).strftime(fmt)
+            if key < cutoff:
+                continue
+            for old in [k for k in buckets if k < cutoff]:
+                del buckets[old]
+            buckets[key] = {}
+        counts = buckets[key].setdefault(str(medicine_id), [0] * len(DEMAND_EVENTS))
+        counts[slot] += count
+    _touch_key('demand_rollups')
+
+def _backfill_demand_rollups(db):
+    """Rebuild rollups from wishlists/donations for data that predates them."""
+    db['demand_rollups'] = {}
+    for item in db.get('wishlists', []):
+        med_id = _as_int(item.get('medicine_id'))
+        created = _parse_ts(item.get('created_at'))
+        if med_id is None or created is None:
+            continue
+        _record_demand(db, med_id, 'requests', created)
+        if item.get('approved') is True:
+            _record_demand(db, med_id, 'approvals', _parse_ts(item.get('approved_at')) or created)
+        if item.get('rejected_at'):
+            _record_demand(db, med_id, 'rejections', _parse_ts(item.get('rejected_at')) or created)
+    for donation in db.get('donations', []):
+        med_id = _as_int(donation.get('medicine_id'))
+        decided = _parse_ts(donation.get('claim_decided_at'))
+        if med_id is not None and decided is not None and donation.get('claim_status') == 'approved':
+            _record_demand(db, med_id, 'fulfilled', decided)
+    return db['demand_rollups']
+
+# Only queued by older versions; kept so their journals still replay
+@_side_effect('adjust_demand')
+def _apply_adjust_demand(db, medicine_id, delta):
+    _apply_demand_event(db, medicine_id, demand_delta=delta)
 
-def _get_item(collection, item_id):
-    db = load_db()
-    item = _find_by_id(db.get(collection, []), item_id)
-    if not item:
-        return jsonify({'error': f'{collection[:-1].capitalize()} not found'}), 404
-    return jsonify(item)
+@_side_effect('demand_event')
+def _apply_demand_event(db, medicine_id, event=None, at=None, demand_delta=0):
+    """Adjust current_demand and count a lifecycle event in the rollups."""
+    med = _ROWS.get('medicines', {}).get(_as_int(medicine_id))
+    if med is None:
+        return
+    if demand_delta:
+        med['current_demand'] = int(med.get('current_demand', 0)) + demand_delta
+        _touch('medicines', med)
+    if event is not None:
+        _record_demand(db, med.get('id'), event, _parse_ts(at) or datetime.now())
 
-def _create_item(collection, payload, defaults=None):
-    db = load_db()
-    item = {**(defaults or {}), **(payload or {})}
-    item['id'] = _next_id(db, collection)
-    # Add created_at if not provided
-    item.setdefault('created_at', datetime.now().isoformat())
-    db[collection].append(item)
-    save_db(db)
-    return jsonify(item), 201
+def _demand_event(medicine_id, event=None, demand_delta=0):
+    """Queue a demand change/event for a medicine (no-op without a medicine id)."""
+    if _as_int(medicine_id) is None:
+        return
+    _SIDE_EFFECTS.put('demand_event', medicine_id=_as_int(medicine_id), event=event,
+                      at=datetime.now().isoformat(), demand_delta=demand_delta)
 
-def _update_item(collection, item_id, payload):
-    db = load_db()
-    items = db.get(collection, [])
-    item = _find_by_id(items, item_id)
-    if not item:
-        return jsonify({'error': f'{collection[:-1].capitalize()} not found'}), 404
-    # Prevent id overwrite
-    payload = {k: v for k, v in (payload or {}).items() if k != 'id'}
-    item.update(payload)
-    save_db(db)
-    return jsonify(item)
+def _parse_window(raw):
+    """'24h' / '7d' (or bare hours) → timedelta; raises ValueError."""
+    match = re.fullmatch(r'(\d+)([hd]?)', (raw or '').strip().lower())
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError('window must look like 24h or 7d')
+    amount = int(match.group(1))
+    return timedelta(days=amount) if match.group(2) == 'd' else timedelta(hours=amount)
 
-def _delete_item(collection, item_id):
-    db = load_db()
-    items = db.get(collection, [])
-    item = _find_by_id(items, item_id)
-    if not item:
-        return jsonify({'error': f'{collection[:-1].capitalize()} not found'}), 404
-    db[collection] = [i for i in items if int(i.get('id')) != int(item_id)]
-    save_db(db)
-    return jsonify({'message': 'Deleted successfully'})
+def _demand_buckets(db, window):
+    """(grain, [(bucket, {medicine_id: counts})]) covering the last window, oldest first."""
+    grain = 'hour' if window <= HOURLY_WINDOW_MAX else 'day'
+    start = (datetime.now() - window).strftime(DEMAND_BUCKETS[grain])
+    buckets = (db.get('demand_rollups') or {}).get(grain, {})
+    return grain, sorted((key, per_med) for key, per_med in buckets.items() if key >= start)
+
+@app.route('/api/analytics/demand', methods=['GET'])
+def demand_analytics():
+    """Top medicines by demand gap (required - current) with activity in ?window= (default 7d).
+
+    ?limit= (default 10); ?order=asc lists the medicines closest to their target first.
+    """
+    try:
+        window = _parse_window(request.args.get('window', '7d'))
+        limit = int(request.args.get('limit', 10))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    order = (request.args.get('order') or 'desc').lower()
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    with _DB_LOCK:
+        db = load_db()
+        grain, buckets = _demand_buckets(db, window)
+        totals: _typing.Dict[str, _typing.List[int]] = {}
+        for _, per_med in buckets:
+            for med_id, counts in per_med.items():
+                acc = totals.setdefault(med_id, [0] * len(DEMAND_EVENTS))
+                for i, n in enumerate(counts):
+                    acc[i] += n
+        medicines = _ROWS.get('medicines', {})
+        rows = []
+        for med_id, counts in totals.items():
+            med = medicines.get(_as_int(med_id))
+            if med is None:
+                continue
+            required = _parse_number(med.get('required_demand')) or 0
+            current = _parse_number(med.get('current_demand')) or 0
+            rows.append({
+                'medicine_id': med.get('id'),
+                'name': med.get('name'),
+                'required_demand': med.get('required_demand'),
+                'current_demand': med.get('current_demand'),
+                'gap': required - current,
+                **dict(zip(DEMAND_EVENTS, counts)),
+            })
+    rows.sort(key=lambda r: (r['gap'], r['medicine_id']), reverse=order == 'desc')
+    return jsonify({
+        'window': request.args.get('window', '7d'),
+        'granularity': grain,
+        'medicines': rows[:max(limit, 0)],
+    })
+
+@app.route('/api/analytics/demand/<int:medicine_id>', methods=['GET'])
+def demand_series(medicine_id):
+    """Bucketed request/approval/rejection/fulfilled counts for one medicine over ?window=."""
+    try:
+        window = _parse_window(request.args.get('window', '7d'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    with _DB_LOCK:
+        db = load_db()
+        if medicine_id not in _ROWS.get('medicines', {}):
+            return jsonify({'error': 'Medicine not found'}), 404
+        grain, buckets = _demand_buckets(db, window)
+        series = [
+            {'bucket': key, **dict(zip(DEMAND_EVENTS, per_med[str(medicine_id)]))}
+            for key, per_med in buckets if str(medicine_id) in per_med
+        ]
+    return jsonify({'medicine_id': medicine_id, 'granularity': grain, 'series': series})
 
 # -----------------------------
 # Users
@@ -515,6 +3147,135 @@ def update_user(item_id):
 def delete_user(item_id):
     return _delete_item('users', item_id)
 
+# Per-user dashboard aggregates
+
+class _UserAggregates:
+    """Per-user counts for the dashboard, maintained on every write.
+
+    Index listener. Each row's contribution (user, counter, amount) is
+    remembered so an update or delete can take back exactly what it added;
+    the dashboard then reads a handful of counters instead of scanning.
+    """
+
+    def __init__(self):
+        self.counts: _typing.Dict[int, Counter] = {}
+        # (collection, user_id) -> id of the user's profile/counters row, and back
+        self.refs: _typing.Dict[_typing.Tuple[str, int], int] = {}
+        self.owners: _typing.Dict[_typing.Tuple[str, int], int] = {}
+        self.contributions: _typing.Dict[_typing.Tuple[str, int], list] = {}
+
+    @staticmethod
+    def _contribution(collection, item):
+        user_id = _as_int(item.get('user_id'))
+        if collection == 'notifications' and user_id is not None:
+            return [(user_id, 'notifications', 1), (user_id, 'unread', 0 if item.get('read') else 1)]
+        if collection == 'wishlists' and user_id is not None:
+            return [(user_id, 'wishlists', 1), (user_id, 'open_wishlists', 1 if _is_open_request(item) else 0)]
+        if collection == 'donations':
+            pending = bool(item.get('claimed_by')) and item.get('claim_status') in (None, 'pending')
+            result = []
+            donor_id = _as_int(item.get('donor_id'))
+            if donor_id is not None:
+                result += [(donor_id, 'donations', 1), (donor_id, 'claims_to_review', 1 if pending else 0)]
+            claimer_id = _as_int(item.get('claimed_by'))
+            if claimer_id is not None:
+                result.append((claimer_id, 'pending_claims', 1 if pending else 0))
+            return result
+        return []
+
+    def _apply(self, contribution, sign):
+        for user_id, name, amount in contribution:
+            if amount:
+                counts = self.counts.get(user_id)
+                if counts is None:
+                    counts = self.counts[user_id] = Counter()
+                counts[name] += sign * amount
+
+    # Index listener protocol
+    def rebuild(self, db):
+        self.counts, self.refs, self.owners, self.contributions = {}, {}, {}, {}
+        for collection in ('notifications', 'wishlists', 'donations', 'profiles', 'counters'):
+            for item in db.get(collection, []):
+                self.put(collection, item)
+
+    def put(self, collection, item):
+        item_id = int(item.get('id'))
+        if collection in ('profiles', 'counters'):
+            user_id = _as_int(item.get('user_id'))
+            if self.owners.get((collection, item_id)) != user_id:
+                self._unref(collection, item_id)
+            if user_id is not None:
+                self.owners[(collection, item_id)] = user_id
+                # One row per user; the first one wins, as with ?user_id= lookups
+                current = self.refs.get((collection, user_id))
+                if current is None or item_id < current:
+                    self.refs[(collection, user_id)] = item_id
+            return
+        key = (collection, item_id)
+        self._apply(self.contributions.pop(key, []), -1)
+        contribution = self._contribution(collection, item)
+        if contribution:
+            self.contributions[key] = contribution
+            self._apply(contribution, 1)
+
+    def _unref(self, collection, item_id):
+        user_id = self.owners.pop((collection, item_id), None)
+        if user_id is not None and self.refs.get((collection, user_id)) == item_id:
+            del self.refs[(collection, user_id)]
+
+    def drop(self, collection, item_id):
+        item_id = int(item_id)
+        if collection in ('profiles', 'counters'):
+            self._unref(collection, item_id)
+            return
+        self._apply(self.contributions.pop((collection, item_id), []), -1)
+
+    def summary(self, user_id):
+        counts = self.counts.get(user_id, Counter())
+        return {
+            'notifications': {'total': counts['notifications'], 'unread': counts['unread']},
+            'wishlists': {'total': counts['wishlists'], 'open': counts['open_wishlists']},
+            'claims': {'pending': counts['pending_claims'], 'to_review': counts['claims_to_review']},
+            'donations': {'total': counts['donations']},
+            'profile_id': self.refs.get(('profiles', user_id)),
+            'counters_id': self.refs.get(('counters', user_id)),
+        }
+
+_USER_AGGREGATES = _UserAggregates()
+_INDEX_LISTENERS.append(_USER_AGGREGATES)
+
+@app.route('/api/users/<int:user_id>/dashboard', methods=['GET'])
+def user_dashboard(user_id):
+    """Everything the home page/layout needs for a user in one O(1) request."""
+    with _DB_LOCK:
+        load_db()
+        user = _ROWS.get('users', {}).get(user_id)
+        if user is None:
+            return jsonify({'error': 'User not found'}), 404
+        summary = _USER_AGGREGATES.summary(user_id)
+        profile = _ROWS.get('profiles', {}).get(summary.pop('profile_id'))
+        counters = _ROWS.get('counters', {}).get(summary.pop('counters_id'))
+        email = user.get('email') or ''
+        if profile is not None:
+            name = ' '.join(p for p in (profile.get('first_name'), profile.get('last_name')) if p).strip()
+            profile = {
+                'id': profile.get('id'),
+                'first_name': profile.get('first_name'),
+                'last_name': profile.get('last_name'),
+                'display_name': name or email.split('@')[0],
+                'avatar_url': profile.get('avatar_url'),
+                'avatar_thumb_url': profile.get('avatar_thumb_url'),
+            }
+        if counters is not None:
+            counters = {k: counters.get(k, 0) for k in ('medicine_purchases', 'donations', 'grant_given')}
+        return jsonify({
+            'user': {'id': user_id, 'email': email, 'role': user.get('role')},
+            'display_name': profile['display_name'] if profile else email.split('@')[0],
+            'profile': profile,
+            'counters': counters,
+            **summary,
+        })
+
 # -----------------------------
 # Medicines
 # -----------------------------
@@ -524,27 +3285,29 @@ def list_medicines():
     # Support simple search via ?query= across name and generic_name
     db = load_db()
     items = db.get('medicines', [])
+    # Expiry range (?expires_after=&expires_before=) is served from the expiry index
+    if request.args.get('expires_after') or request.args.get('expires_before'):
+        try:
+            items = _expiring_items('medicines')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     query = (request.args.get('query') or '').strip().lower()
     if query:
         items = [
             m for m in items
             if query in (m.get('name', '').lower()) or query in (m.get('generic_name', '').lower())
         ]
-    # Optional additional exact-match filters are handled generically
-    if request.args:
-        filtered = []
-        for item in items:
-            include = True
-            for key, value in request.args.items():
-                if key == 'query':
-                    continue
-                if str(item.get(key)) != value:
-                    include = False
-                    break
-            if include:
-                filtered.append(item)
-        items = filtered
-    return jsonify(items)
+    # Optional additional field filters are handled generically
+    try:
+        items = _filter_items('medicines', items, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_rows_snapshot(items))
+
+@app.route('/api/medicines/expiring', methods=['GET'])
+def list_expiring_medicines():
+    """Medicines expiring within ?days= (default 30), soonest first."""
+    return _list_expiring('medicines')
 
 @app.route('/api/medicines/<int:item_id>', methods=['GET'])
 def get_medicine(item_id):
@@ -596,34 +3359,49 @@ def create_wishlist():
     }
     # Create wishlist item
     response = _create_item('wishlists', payload, defaults=defaults)
-    # Increment medicine demand and create a notification
-    try:
-        db = load_db()
-        med = _find_by_id(db.get('medicines', []), defaults.get('medicine_id'))
+    # Increment medicine demand and notify the user in the background
+    if response[1] == 201:
+        med = _ROWS.get('medicines', {}).get(_as_int(defaults.get('medicine_id')))
         if med is not None:
-            med['current_demand'] = int(med.get('current_demand', 0)) + 1
-            save_db(db)
-        # Create notification for user
-        notif_payload = {
+            _demand_event(med.get('id'), 'requests', demand_delta=1)
+        _notify({
             'user_id': defaults.get('user_id'),
             'type': 'wishlist',
             'title': 'Added to Wishlist',
             'message': f"Your request for {med.get('name') if med else 'medicine'} was added to wishlist.",
             'read': False,
-        }
-        _create_item('notifications', notif_payload)
-    except Exception:
-        pass
+        })
     return response
 
+# Wishlist fields that open or close a request, changed only by the routes
+# that also account for medicine demand
+WISHLIST_DEMAND_FIELDS = ('medicine_id', 'approved', 'approved_at', 'rejected_at', 'fulfilled', 'fulfilled_at')
+
 @app.route('/api/wishlists/<int:item_id>', methods=['PUT', 'PATCH'])
 def update_wishlist(item_id):
     payload = request.get_json() or {}
+    locked = [field for field in WISHLIST_DEMAND_FIELDS if field in payload]
+    if locked:
+        return jsonify({
+            'error': f"{', '.join(locked)} cannot be updated directly; use /approve or /reject, "
+                     'or delete the request and create a new one'
+        }), 400
     return _update_item('wishlists', item_id, payload)
 
 @app.route('/api/wishlists/<int:item_id>', methods=['DELETE'])
 def delete_wishlist(item_id):
-    return _delete_item('wishlists', item_id)
+    withdrawn = []
+
+    def withdraw(item):
+        # Decided under the lock, so a concurrent reject cannot also count it
+        if _is_open_request(item):
+            withdrawn.append(item.get('medicine_id'))
+
+    response = _delete_item('wishlists', item_id, on_delete=withdraw)
+    # A withdrawn open request no longer counts towards demand
+    if withdrawn:
+        _demand_event(withdrawn[0], demand_delta=-1)
+    return response
 
 # -----------------------------
 # Donations
@@ -634,6 +3412,17 @@ def list_donations():
     # Support simple search via ?query= across related medicine name and generic_name
     db = load_db()
     donations = db.get('donations', [])
+    if request.args.get('expires_after') or request.args.get('expires_before'):
+        try:
+            donations = _expiring_items('donations')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    # Hide unclaimed stock past its expiry date unless explicitly requested
+    not_expired = None
+    if request.args.get('include_expired') not in ('1', 'true'):
+        expired = _expired_ids('donations')
+        if expired:
+            not_expired = lambda d: int(d.get('id')) not in expired or bool(d.get('claimed_by'))
     query = (request.args.get('query') or '').strip().lower()
     if query:
         medicines = db.get('medicines', [])
@@ -645,21 +3434,23 @@ def list_donations():
             d for d in donations
             if (d.get('medicine_id') in matching_med_ids) or (query in str(d.get('medicine_name', '')).lower())
         ]
-    # Optional additional exact-match filters are handled generically (excluding query)
-    if request.args:
-        filtered = []
-        for item in donations:
-            include = True
-            for key, value in request.args.items():
-                if key == 'query':
-                    continue
-                if str(item.get(key)) != value:
-                    include = False
-                    break
-            if include:
-                filtered.append(item)
-        donations = filtered
-    return jsonify(donations)
+    # Optional additional field filters are handled generically (excluding query)
+    try:
+        donations = _filter_items('donations', donations, request.args, predicate=not_expired)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_rows_snapshot(donations))
+
+@app.route('/api/donations/expiring', methods=['GET'])
+def list_expiring_donations():
+    """Unclaimed donations expiring within ?days= (default 30), soonest first."""
+    return _list_expiring('donations', exclude=lambda d: bool(d.get('claimed_by')))
+
+@app.route('/api/donations/sweep-expired', methods=['POST'])
+def sweep_expired_route():
+    """Run the expired-donation sweep now instead of waiting for the background timer."""
+    flagged = sweep_expired_donations()
+    return jsonify({'message': 'Sweep complete', 'flagged': [d.get('id') for d in flagged]})
 
 @app.route('/api/donations/<int:item_id>', methods=['GET'])
 def get_donation(item_id):
@@ -784,6 +3575,158 @@ def update_profile(item_id):
 def delete_profile(item_id):
     return _delete_item('profiles', item_id)
 
+# -----------------------------
+# Avatars
+# -----------------------------
+
+# Optional: Pillow for thumbnails; without it the original image is served
+try:
+    from PIL import Image as _PILImage, ImageOps as _PILImageOps  # type: ignore
+except Exception:
+    _PILImage = None
+    _PILImageOps = None
+
+AVATAR_DIR = os.getenv('AVATAR_DIR') or os.path.join(os.path.dirname(__file__), 'avatars')
+AVATAR_SIZES = (48, 128, 256)
+AVATAR_MAX_BYTES = 5 * 1024 * 1024
+_AVATAR_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+_IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+# Magic bytes → extension for accepted uploads
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+def _image_extension(data):
+    for signature, ext in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def _avatar_original(avatar_hash):
+    """Path of the stored original for a hash, or None."""
+    folder = os.path.join(AVATAR_DIR, avatar_hash)
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            if name.startswith('original.'):
+                return os.path.join(folder, name)
+    return None
+
+def _avatar_thumbnail(avatar_hash, size):
+    return os.path.join(AVATAR_DIR, avatar_hash, f'{size}.webp')
+
+def _avatar_urls(avatar_hash):
+    urls = {str(size): f'/api/avatars/{avatar_hash}/{size}' for size in AVATAR_SIZES}
+    urls['original'] = f'/api/avatars/{avatar_hash}/original'
+    return urls
+
+def _generate_thumbnails(avatar_hash):
+    """Write square WebP thumbnails for every AVATAR_SIZES entry that is missing."""
+    original = _avatar_original(avatar_hash)
+    if _PILImage is None or original is None:
+        return
+    with _PILImage.open(original) as img:
+        img = _PILImageOps.exif_transpose(img)
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        for size in AVATAR_SIZES:
+            path = _avatar_thumbnail(avatar_hash, size)
+            if os.path.exists(path):
+                continue
+            thumb = _PILImageOps.fit(img, (size, size), method=_PILImage.LANCZOS)
+            tmp_path = path + '.tmp'
+            thumb.save(tmp_path, format='WEBP', quality=85)
+            os.replace(tmp_path, path)
+
+_THUMBNAIL_QUEUE: 'queue.Queue[str]' = queue.Queue()
+_THUMBNAIL_WORKER: _typing.Dict[str, _typing.Any] = {'thread': None}
+
+def _thumbnail_worker():
+    while True:
+        avatar_hash = _THUMBNAIL_QUEUE.get()
+        try:
+            _generate_thumbnails(avatar_hash)
+        except Exception:
+            pass
+        finally:
+            _THUMBNAIL_QUEUE.task_done()
+
+def _enqueue_thumbnails(avatar_hash):
+    """Resize off the request thread; the worker is started on first use."""
+    with _DB_LOCK:
+        if _THUMBNAIL_WORKER['thread'] is None:
+            _THUMBNAIL_WORKER['thread'] = threading.Thread(target=_thumbnail_worker, name='avatar-thumbnails', daemon=True)
+            _THUMBNAIL_WORKER['thread'].start()
+    _THUMBNAIL_QUEUE.put(avatar_hash)
+
+@app.route('/api/avatars', methods=['POST'])
+def upload_avatar():
+    """Store an avatar by content hash and link it from the user's profile.
+
+    multipart/form-data with `file` and `user_id`. Identical images share one
+    stored copy; thumbnails are generated in the background.
+    """
+    uploaded = request.files.get('file')
+    user_id = request.form.get('user_id') or request.form.get('userId')
+    if uploaded is None or not user_id:
+        return jsonify({'error': 'file and user_id are required'}), 400
+    data = uploaded.read(AVATAR_MAX_BYTES + 1)
+    if len(data) > AVATAR_MAX_BYTES:
+        return jsonify({'error': 'Image too large'}), 413
+    ext = _image_extension(data)
+    if ext is None:
+        return jsonify({'error': 'Unsupported image type'}), 400
+    avatar_hash = hashlib.sha256(data).hexdigest()
+    if _avatar_original(avatar_hash) is None:
+        folder = os.path.join(AVATAR_DIR, avatar_hash)
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = os.path.join(folder, f'original.{ext}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(folder, f'original.{ext}'))
+    if any(not os.path.exists(_avatar_thumbnail(avatar_hash, size)) for size in AVATAR_SIZES):
+        _enqueue_thumbnails(avatar_hash)
+
+    urls = _avatar_urls(avatar_hash)
+    fields = {
+        'avatar_hash': avatar_hash,
+        'avatar_url': urls[str(AVATAR_SIZES[-1])],
+        'avatar_thumb_url': urls[str(AVATAR_SIZES[0])],
+    }
+    with _DB_LOCK:
+        db = load_db()
+        profile = next((p for p in db.get('profiles', []) if str(p.get('user_id')) == str(user_id)), None)
+        if profile is not None:
+            profile.update(fields)
+            _touch('profiles', profile)
+    if profile is not None:
+        save_db(db)
+    return jsonify({**fields, 'url': fields['avatar_url'], 'urls': urls}), 201
+
+@app.route('/api/avatars/<avatar_hash>/<size>', methods=['GET'])
+def get_avatar(avatar_hash, size):
+    """Serve an avatar rendition; content-addressed URLs are cached as immutable."""
+    if not _AVATAR_HASH_RE.match(avatar_hash) or (size != 'original' and size not in {str(s) for s in AVATAR_SIZES}):
+        return jsonify({'error': 'Avatar not found'}), 404
+    original = _avatar_original(avatar_hash)
+    if original is None:
+        return jsonify({'error': 'Avatar not found'}), 404
+    path = original if size == 'original' else _avatar_thumbnail(avatar_hash, size)
+    cache_control, etag = _IMMUTABLE_CACHE, avatar_hash + '-' + size
+    if not os.path.exists(path):
+        # Thumbnail still pending (or Pillow unavailable): serve the original
+        # briefly, under its own ETag so revalidating fetches the thumbnail
+        # once it exists
+        path = original
+        cache_control, etag = 'public, max-age=300', avatar_hash + '-original'
+    response = send_file(path, conditional=True, etag=etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
 # -----------------------------
 # Counters (per-user activity counters)
 # -----------------------------
@@ -854,27 +3797,31 @@ def clear_notifications():
     """Clear all notifications or mark as read. Query param action=delete|read (default read). Optional user_id filter."""
     action = request.args.get('action', 'read')
     user_id = request.args.get('user_id')
-    db = load_db()
-    items = db.get('notifications', [])
-    if user_id is not None:
-        # filter by user_id (string compare safe)
-        target = [n for n in items if str(n.get('user_id')) == str(user_id)]
-    else:
-        target = items
-
-    if action == 'delete':
+    with _DB_LOCK:
+        db = load_db()
+        items = db.get('notifications', [])
         if user_id is not None:
-            db['notifications'] = [n for n in items if str(n.get('user_id')) != str(user_id)]
+            # filter by user_id (string compare safe)
+            target = [n for n in items if str(n.get('user_id')) == str(user_id)]
         else:
-            db['notifications'] = []
-        save_db(db)
-        return jsonify({'message': 'Notifications cleared'})
-    else:
-        # mark as read
-        for n in target:
-            n['read'] = True
-        save_db(db)
-        return jsonify({'message': 'Notifications marked as read'})
+            target = items
+
+        if action == 'delete':
+            if user_id is not None:
+                db['notifications'] = [n for n in items if str(n.get('user_id')) != str(user_id)]
+            else:
+                db['notifications'] = []
+            for n in target:
+                _index_drop('notifications', n.get('id'))
+            message = 'Notifications cleared'
+        else:
+            # mark as read
+            for n in target:
+                n['read'] = True
+                _touch('notifications', n)
+            message = 'Notifications marked as read'
+    save_db(db)
+    return jsonify({'message': message})
 
 # -----------------------------
 # Transactions & Fund Summary
@@ -912,7 +3859,8 @@ def fund_summary():
     total_contributions = sum(t.get('amount', 0) for t in txs if t.get('type') == 'contribution')
     total_disbursements = sum(t.get('amount', 0) for t in txs if t.get('type') == 'disbursement')
     balance = total_contributions - total_disbursements
-    recent = sorted(txs, key=lambda t: t.get('created_at', ''), reverse=True)[:10]
+    recent = list(itertools.islice(_INDEXES['transactions']['created_at'].range(reverse=True), 10))
+    recent = [_ROWS['transactions'][i] for i in recent]
     return jsonify({
         'balance': balance,
         'total_contributions': total_contributions,
@@ -920,6 +3868,92 @@ def fund_summary():
         'recent': recent,
     })
 
+# -----------------------------
+# Micro grants
+# -----------------------------
+
+MICRO_GRANT_MAX_AMOUNT = 200
+
+def _requester_name(db, user_id, email=''):
+    """Display name for a grant requester: profile name, else email local part."""
+    if user_id:
+        for profile in db.get('profiles', []):
+            if str(profile.get('user_id')) == str(user_id):
+                joined = f"{profile.get('first_name') or ''} {profile.get('last_name') or ''}".strip()
+                if joined:
+                    return joined
+                break
+        user = _ROWS.get('users', {}).get(_as_int(user_id)) or {}
+        email = user.get('email') or email
+    if email:
+        return str(email).split('@')[0]
+    return 'Anonymous'
+
+@app.route('/api/micro-grants', methods=['GET'])
+def list_micro_grants():
+    """Micro grants, newest first (undated ones last) unless ?sort= is given."""
+    args = request.args.copy()
+    if 'sort' not in args:
+        args['sort'] = 'created_at'
+        args.setdefault('order', 'desc')
+    return _list_items('micro_grants', args)
+
+@app.route('/api/micro-grants/<int:item_id>', methods=['GET'])
+def get_micro_grant(item_id):
+    return _get_item('micro_grants', item_id)
+
+@app.route('/api/micro-grants', methods=['POST'])
+def create_micro_grant():
+    payload = request.get_json() or {}
+    title = str(payload.get('title') or '').strip()
+    description = str(payload.get('description') or '').strip()
+    amount = _parse_number(payload.get('amountNeeded', payload.get('amount')))
+    if not title or not description or amount is None or not 1 <= amount <= MICRO_GRANT_MAX_AMOUNT:
+        return jsonify({'error': f'title, description and amountNeeded (1-{MICRO_GRANT_MAX_AMOUNT}) are required'}), 400
+    if isinstance(amount, float) and amount.is_integer():
+        amount = int(amount)
+    requestor_id = payload.get('requestor_id') or None
+    db = load_db()
+    item = {
+        'requesterName': _requester_name(db, requestor_id, payload.get('email', '')),
+        'title': title,
+        'description': description,
+        'amountNeeded': amount,
+        'amountRaised': 0,
+        'timePosted': 'just now',
+        'supporters': 0,
+        'verified': False,
+        'urgent': bool(payload.get('urgent', False)),
+        'requestor_id': requestor_id,
+    }
+    return _create_item('micro_grants', item)
+
+@app.route('/api/micro-grants/<int:item_id>/support', methods=['POST'])
+def support_micro_grant(item_id):
+    """Record a contribution: amountRaised += amount and supporters += 1, atomically."""
+    payload = request.get_json() or {}
+    amount = _parse_number(payload.get('amount'))
+    if amount is None or amount <= 0:
+        return jsonify({'error': 'amount must be > 0'}), 400
+
+    def support(grant):
+        grant['amountRaised'] = (_parse_number(grant.get('amountRaised')) or 0) + amount
+        grant['supporters'] = int(grant.get('supporters') or 0) + 1
+
+    grant, error = _conditional_update('micro_grants', item_id, support)
+    if error is not None:
+        return error
+    return _with_etag(jsonify(grant), grant)
+
+@app.route('/api/micro-grants/<int:item_id>', methods=['PUT', 'PATCH'])
+def update_micro_grant(item_id):
+    payload = request.get_json() or {}
+    return _update_item('micro_grants', item_id, payload)
+
+@app.route('/api/micro-grants/<int:item_id>', methods=['DELETE'])
+def delete_micro_grant(item_id):
+    return _delete_item('micro_grants', item_id)
+
 # -----------------------------
 # Actions: Donation Claim & Wishlist Approve
 # -----------------------------
@@ -930,135 +3964,179 @@ def claim_donation(item_id):
     user_id = payload.get('user_id')
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
-    db = load_db()
-    donation = _find_by_id(db.get('donations', []), item_id)
-    if not donation:
-        return jsonify({'error': 'Donation not found'}), 404
-    if donation.get('claimed_by'):
-        return jsonify({'error': 'Donation already claimed'}), 400
-    donation['claimed_by'] = user_id
-    donation['claimed_at'] = datetime.now().isoformat()
-    donation['claim_status'] = 'pending'
-    save_db(db)
+    try:
+        expected = _expected_version(payload)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'If-Match / expected_version must be a version number'}), 400
+
+    def claim(donation):
+        if donation.get('claimed_by'):
+            return jsonify({'error': 'Donation already claimed'}), 400
+        donation['claimed_by'] = user_id
+        donation['claimed_at'] = datetime.now().isoformat()
+        donation['claim_status'] = 'pending'
+
+    donation, error = _conditional_update('donations', item_id, claim, expected)
+    if error is not None:
+        return error
     # Notify donor (if any) and claimer
+    med_name = _donation_label(donation, item_id)
+    _notify({
+        'user_id': user_id,
+        'type': 'donation',
+        'title': 'Request Submitted',
+        'message': f"You requested {med_name}.",
+    })
+    return _with_etag(jsonify({'message': 'Donation claimed', 'version': donation['version']}), donation)
+
+def _donation_label(donation, item_id):
     try:
         med_name = donation.get('medicine_name')
         if not med_name:
-            med = _find_by_id(db.get('medicines', []), donation.get('medicine_id'))
+            med = _find_by_id(load_db().get('medicines', []), donation.get('medicine_id'))
             med_name = (med or {}).get('name') or f"donation #{item_id}"
     except Exception:
         med_name = f"donation #{item_id}"
-    _create_item('notifications', {
-        'user_id': user_id,
-        'type': 'donation',
-        'title': 'Request Submitted',
-        'message': f"You requested {med_name}.",
-    })
-    return jsonify({'message': 'Donation claimed'})
+    return med_name
+
+def _wishlist_label(item):
+    try:
+        med = _find_by_id(load_db().get('medicines', []), item.get('medicine_id'))
+        return (med or {}).get('name') or f"medicine #{item.get('medicine_id')}"
+    except Exception:
+        return f"medicine #{item.get('medicine_id')}"
+
+def _action_update(collection, item_id, mutate):
+    """Run an action route's mutation as a conditional update (If-Match honoured)."""
+    try:
+        expected = _expected_version(request.get_json(silent=True))
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'If-Match / expected_version must be a version number'}), 400)
+    return _conditional_update(collection, item_id, mutate, expected)
 
 @app.route('/api/wishlists/<int:item_id>/approve', methods=['POST'])
 def approve_wishlist(item_id):
-    db = load_db()
-    item = _find_by_id(db.get('wishlists', []), item_id)
-    if not item:
-        return jsonify({'error': 'Wishlist not found'}), 404
-    if item.get('approved') is True:
-        return jsonify({'message': 'Already approved'})
-    item['approved'] = True
-    save_db(db)
+    reopened = []
+
+    def approve(item):
+        if item.get('approved') is True:
+            return jsonify({'message': 'Already approved'})
+        item['approved'] = True
+        item['approved_at'] = datetime.now().isoformat()
+        # Approving a rejected request re-opens it
+        if item.pop('rejected_at', None) and not item.get('fulfilled'):
+            reopened.append(True)
+
+    item, error = _action_update('wishlists', item_id, approve)
+    if error is not None:
+        return error
+    _demand_event(item.get('medicine_id'), 'approvals', demand_delta=1 if reopened else 0)
     # Notify user
-    try:
-        med = _find_by_id(db.get('medicines', []), item.get('medicine_id'))
-        med_name = (med or {}).get('name') or f"medicine #{item.get('medicine_id')}"
-    except Exception:
-        med_name = f"medicine #{item.get('medicine_id')}"
-    _create_item('notifications', {
+    _notify({
         'user_id': item.get('user_id'),
         'type': 'approval',
         'title': 'Request Approved',
-        'message': f"Your request for {med_name} has been approved.",
+        'message': f"Your request for {_wishlist_label(item)} has been approved.",
         # Provide an action link to checkout the medicine
         'action_url': f"/checkout/{item.get('medicine_id')}",
     })
-    return jsonify(item)
+    return _with_etag(jsonify(item), item)
 
 @app.route('/api/wishlists/<int:item_id>/reject', methods=['POST'])
 def reject_wishlist(item_id):
-    db = load_db()
-    item = _find_by_id(db.get('wishlists', []), item_id)
-    if not item:
-        return jsonify({'error': 'Wishlist not found'}), 404
-    item['approved'] = False
-    item['rejected_at'] = datetime.now().isoformat()
-    save_db(db)
-    try:
-        med = _find_by_id(db.get('medicines', []), item.get('medicine_id'))
-        med_name = (med or {}).get('name') or f"medicine #{item.get('medicine_id')}"
-    except Exception:
-        med_name = f"medicine #{item.get('medicine_id')}"
-    _create_item('notifications', {
+    was_open = []
+
+    def reject(item):
+        if _is_open_request(item):
+            was_open.append(True)
+        item['approved'] = False
+        item['rejected_at'] = datetime.now().isoformat()
+
+    item, error = _action_update('wishlists', item_id, reject)
+    if error is not None:
+        return error
+    if was_open:
+        _demand_event(item.get('medicine_id'), 'rejections', demand_delta=-1)
+    _notify({
         'user_id': item.get('user_id'),
         'type': 'approval',
         'title': 'Request Rejected',
-        'message': f"Your request for {med_name} was not approved at this time.",
+        'message': f"Your request for {_wishlist_label(item)} was not approved at this time.",
     })
-    return jsonify(item)
+    return _with_etag(jsonify(item), item)
+
+def _decide_claim(status):
+    def decide(donation):
+        if not donation.get('claimed_by'):
+            return jsonify({'error': 'No pending claim'}), 400
+        donation['claim_status'] = status
+        donation['claim_decided_at'] = datetime.now().isoformat()
+    return decide
 
 @app.route('/api/donations/<int:item_id>/approve-claim', methods=['POST'])
 def approve_donation_claim(item_id):
-    db = load_db()
-    donation = _find_by_id(db.get('donations', []), item_id)
-    if not donation:
-        return jsonify({'error': 'Donation not found'}), 404
-    if not donation.get('claimed_by'):
-        return jsonify({'error': 'No pending claim'}), 400
-    donation['claim_status'] = 'approved'
-    donation['claim_decided_at'] = datetime.now().isoformat()
-    save_db(db)
-    try:
-        med_name = donation.get('medicine_name')
-        if not med_name:
-            db = load_db()
-            med = _find_by_id(db.get('medicines', []), donation.get('medicine_id'))
-            med_name = (med or {}).get('name') or f"donation #{item_id}"
-    except Exception:
-        med_name = f"donation #{item_id}"
-    _create_item('notifications', {
+    previous = []
+    fulfilled = []
+    decide = _decide_claim('approved')
+
+    def approve(donation):
+        previous.append(donation.get('claim_status'))
+        error = decide(donation)
+        if error is None and previous[-1] != 'approved':
+            # The claimer's open request for this medicine is met
+            wishlist = _MATCHER.open_request(donation.get('medicine_id'), donation.get('claimed_by'))
+            if wishlist is not None:
+                wishlist['fulfilled'] = True
+                wishlist['fulfilled_at'] = donation.get('claim_decided_at')
+                _touch('wishlists', wishlist)
+                donation['fulfilled_wishlist_id'] = int(wishlist.get('id'))
+                fulfilled.append(True)
+        return error
+
+    donation, error = _action_update('donations', item_id, approve)
+    if error is not None:
+        return error
+    if previous[-1] != 'approved':
+        _demand_event(donation.get('medicine_id'), 'fulfilled', demand_delta=-1 if fulfilled else 0)
+    _notify({
         'user_id': donation.get('claimed_by'),
         'type': 'donation',
         'title': 'Request Approved',
-        'message': f"Your request for {med_name} was approved.",
+        'message': f"Your request for {_donation_label(donation, item_id)} was approved.",
         'action_url': f"/donate-meds?highlight={item_id}",
     })
-    return jsonify(donation)
+    return _with_etag(jsonify(donation), donation)
 
 @app.route('/api/donations/<int:item_id>/reject-claim', methods=['POST'])
 def reject_donation_claim(item_id):
-    db = load_db()
-    donation = _find_by_id(db.get('donations', []), item_id)
-    if not donation:
-        return jsonify({'error': 'Donation not found'}), 404
-    if not donation.get('claimed_by'):
-        return jsonify({'error': 'No pending claim'}), 400
-    user_id = donation.get('claimed_by')
-    donation['claim_status'] = 'rejected'
-    donation['claim_decided_at'] = datetime.now().isoformat()
-    save_db(db)
-    try:
-        med_name = donation.get('medicine_name')
-        if not med_name:
-            db = load_db()
-            med = _find_by_id(db.get('medicines', []), donation.get('medicine_id'))
-            med_name = (med or {}).get('name') or f"donation #{item_id}"
-    except Exception:
-        med_name = f"donation #{item_id}"
-    _create_item('notifications', {
-        'user_id': user_id,
+    reopened = []
+    decide = _decide_claim('rejected')
+
+    def reject(donation):
+        error = decide(donation)
+        if error is None:
+            # Rejecting a claim approved earlier re-opens the request it fulfilled
+            wishlist = _ROWS.get('wishlists', {}).get(_as_int(donation.pop('fulfilled_wishlist_id', None)))
+            if wishlist is not None and wishlist.get('fulfilled'):
+                wishlist.pop('fulfilled')
+                wishlist.pop('fulfilled_at', None)
+                _touch('wishlists', wishlist)
+                if _is_open_request(wishlist):
+                    reopened.append(wishlist.get('medicine_id'))
+        return error
+
+    donation, error = _action_update('donations', item_id, reject)
+    if error is not None:
+        return error
+    if reopened:
+        _demand_event(reopened[0], demand_delta=1)
+    _notify({
+        'user_id': donation.get('claimed_by'),
         'type': 'donation',
         'title': 'Request Rejected',
-        'message': f"Your request for {med_name} was rejected.",
+        'message': f"Your request for {_donation_label(donation, item_id)} was rejected.",
     })
-    return jsonify(donation)
+    return _with_etag(jsonify(donation), donation)
 
 # Allow a user to cancel their pending claim
 @app.route('/api/donations/<int:item_id>/cancel-claim', methods=['POST'])
@@ -1067,36 +4145,310 @@ def cancel_donation_claim(item_id):
     user_id = payload.get('user_id')
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
-    db = load_db()
-    donation = _find_by_id(db.get('donations', []), item_id)
-    if not donation:
-        return jsonify({'error': 'Donation not found'}), 404
-    if donation.get('claimed_by') != user_id:
-        return jsonify({'error': 'Not your request to cancel'}), 403
-    # Only allow cancel if still pending
-    if donation.get('claim_status') not in (None, 'pending'):
-        return jsonify({'error': 'Cannot cancel after decision'}), 400
-    # Reset claim fields
-    donation['claimed_by'] = None
-    donation['claimed_at'] = None
-    donation['claim_status'] = None
-    donation['claim_decided_at'] = None
-    save_db(db)
-    try:
-        med_name = donation.get('medicine_name')
-        if not med_name:
-            med = _find_by_id(db.get('medicines', []), donation.get('medicine_id'))
-            med_name = (med or {}).get('name') or f"donation #{item_id}"
-    except Exception:
-        med_name = f"donation #{item_id}"
-    _create_item('notifications', {
+
+    def cancel(donation):
+        if donation.get('claimed_by') != user_id:
+            return jsonify({'error': 'Not your request to cancel'}), 403
+        # Only allow cancel if still pending
+        if donation.get('claim_status') not in (None, 'pending'):
+            return jsonify({'error': 'Cannot cancel after decision'}), 400
+        # Reset claim fields
+        donation['claimed_by'] = None
+        donation['claimed_at'] = None
+        donation['claim_status'] = None
+        donation['claim_decided_at'] = None
+
+    donation, error = _action_update('donations', item_id, cancel)
+    if error is not None:
+        return error
+    _notify({
         'user_id': user_id,
         'type': 'donation',
         'title': 'Request Canceled',
-        'message': f"You canceled your request for {med_name}.",
+        'message': f"You canceled your request for {_donation_label(donation, item_id)}.",
+    })
+    return _with_etag(jsonify({'message': 'Claim canceled', 'version': donation['version']}), donation)
+
+# -----------------------------
+# Snapshots & backups
+# -----------------------------
+
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR') or os.path.join(os.path.dirname(__file__), 'snapshots')
+_SNAPSHOT_LOCK = threading.Lock()
+
+def _write_json_atomic(path, value, indent=None):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f, indent=indent, default=_json_default)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _freeze_collections(db, names):
+    """Point-in-time copy of the named DB keys.
+
+    Lists get fresh lists of shallow record copies: write paths replace field
+    values rather than mutating nested ones, so this is consistent while being
+    cheap enough to take under the DB lock. Serialization happens afterwards.
+    """
+    frozen = {}
+    for name in names:
+        value = db.get(name)
+        if isinstance(value, list):
+            frozen[name] = [dict(item) if isinstance(item, (dict, _Record)) else item for item in value]
+        else:
+            frozen[name] = copy.deepcopy(value)
+    return frozen
+
+def list_snapshots():
+    """Manifests of completed snapshots, oldest first."""
+    manifests = []
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return manifests
+    for name in sorted(os.listdir(SNAPSHOT_DIR)):
+        path = os.path.join(SNAPSHOT_DIR, name, 'manifest.json')
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    manifests.append(json.load(f))
+            except Exception:
+                continue
+    return manifests
+
+def create_snapshot(full=False):
+    """Write a consistent snapshot of the DB without blocking request handling.
+
+    Only the in-memory freeze holds the DB lock. Incremental snapshots write
+    just the keys changed since the previous snapshot and reference the
+    previous files for the rest; the manifest is written last, so a snapshot
+    only exists once it is complete.
+    """
+    with _SNAPSHOT_LOCK:
+        snapshots = list_snapshots()
+        previous = snapshots[-1] if snapshots and not full else None
+        with _DB_LOCK:
+            db = load_db()
+            names = list(db.keys())
+            if previous is None:
+                changed = set(names)
+            else:
+                changed = (set(_CHANGED_SINCE_SNAPSHOT) | {'meta'} | (set(names) - set(previous['collections']))) & set(names)
+            frozen = _freeze_collections(db, [n for n in names if n in changed])
+            _CHANGED_SINCE_SNAPSHOT.difference_update(changed)
+        try:
+            snapshot_id = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+            os.makedirs(os.path.join(SNAPSHOT_DIR, snapshot_id), exist_ok=True)
+            collections = {}
+            for name in names:
+                if name in frozen:
+                    collections[name] = f"{snapshot_id}/{name}.json"
+                    _write_json_atomic(os.path.join(SNAPSHOT_DIR, collections[name]), frozen[name])
+                else:
+                    collections[name] = previous['collections'][name]
+            manifest = {
+                'id': snapshot_id,
+                'created_at': datetime.now().isoformat(),
+                'base': previous['id'] if previous else None,
+                'written': sorted(frozen),
+                'collections': collections,
+            }
+            _write_json_atomic(os.path.join(SNAPSHOT_DIR, snapshot_id, 'manifest.json'), manifest, indent=2)
+            return manifest
+        except Exception:
+            # Keep the changes pending for the next attempt
+            _CHANGED_SINCE_SNAPSHOT.update(changed)
+            raise
+
+def restore_snapshot(snapshot_id):
+    """Replace data.json with the contents of a snapshot."""
+    path = os.path.join(SNAPSHOT_DIR, snapshot_id, 'manifest.json')
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    db = {}
+    for name, rel_path in manifest['collections'].items():
+        with open(os.path.join(SNAPSHOT_DIR, rel_path), 'r') as f:
+            db[name] = json.load(f)
+    save_db(_ensure_db_shape(db))
+    return manifest
+
+@app.route('/api/snapshots', methods=['GET'])
+def list_snapshots_route():
+    return jsonify(list_snapshots())
+
+@app.route('/api/snapshots', methods=['POST'])
+def create_snapshot_route():
+    """Take a snapshot; incremental unless ?full=1."""
+    try:
+        manifest = create_snapshot(full=request.args.get('full') in ('1', 'true'))
+    except Exception as e:
+        return jsonify({'error': f'Snapshot failed: {e}'}), 500
+    return jsonify(manifest), 201
+
+# -----------------------------
+# Bulk export & import (NDJSON)
+# -----------------------------
+
+EXPORT_BATCH_SIZE = 500
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+# Cap on per-row details (errors, remapped ids) echoed back by an import
+IMPORT_REPORT_LIMIT = 1000
+
+def _collection_from_path(name):
+    """URL segment (e.g. micro-grants) → collection name, or None if unknown."""
+    collection = name.replace('-', '_')
+    return collection if collection in COLLECTIONS else None
+
+def _export_lines(collection, predicate=None):
+    """Yield a collection as NDJSON, copying rows in small batches under the lock."""
+    with _DB_LOCK:
+        rows = list(load_db().get(collection, []))
+    for start in range(0, len(rows), EXPORT_BATCH_SIZE):
+        with _DB_LOCK:
+            batch = [dict(item) for item in rows[start:start + EXPORT_BATCH_SIZE]]
+        yield ''.join(
+            json.dumps(item, default=_json_default) + '\n'
+            for item in batch if predicate is None or predicate(item)
+        )
+
+@app.route('/api/<name>/export', methods=['GET'])
+def export_collection(name):
+    """Stream a collection as NDJSON; field filters as on list endpoints apply."""
+    collection = _collection_from_path(name)
+    if collection is None:
+        return jsonify({'error': f'Unknown collection {name}'}), 404
+    try:
+        predicate = _CompiledFilter(collection, request.args).predicate
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(_export_lines(collection, predicate), mimetype='application/x-ndjson', headers={
+        'Content-Disposition': f'attachment; filename={collection}.ndjson',
+        'X-Accel-Buffering': 'no',
     })
-    return jsonify({'message': 'Claim canceled'})
+
+def _import_batch(collection, rows, offset, remapped):
+    """Insert one batch and commit it with a single save.
+
+    Incoming ids become id + offset (offset 0 keeps them); rows without an id,
+    or whose target id is taken, get a fresh id recorded in remapped.
+    """
+    with _DB_LOCK:
+        db = load_db()
+        taken = _ROWS.get(collection, {})
+        for row in rows:
+            source_id = _as_int(row.pop('id', None))
+            row.pop('version', None)
+            target = source_id + offset if source_id is not None and source_id > 0 else None
+            if target is not None and target in taken:
+                target = None
+            item = _insert_item(db, collection, row, item_id=target)
+            if source_id is not None and item['id'] != source_id + offset:
+                remapped.append((source_id, item['id']))
+    save_db(db)
+
+def import_lines(collection, lines, batch_size=IMPORT_BATCH_SIZE, keep_ids=False):
+    """Import NDJSON lines into a collection in bounded batches.
+
+    Ids are shifted by the collection's id counter at the start of the import,
+    so they cannot collide with existing rows and references between imported
+    collections can be remapped with one number per collection (id_offset).
+    keep_ids imports ids unchanged where free (e.g. into an empty collection).
+    Memory stays bounded by the batch size however long the stream is; bad
+    lines are skipped and reported (up to IMPORT_REPORT_LIMIT).
+    """
+    with _DB_LOCK:
+        offset = 0 if keep_ids else int(load_db()['meta']['counters'].get(collection, 0))
+    summary = {
+        'collection': collection, 'id_offset': offset, 'imported': 0, 'batches': 0,
+        'skipped': 0, 'errors': [], 'remapped': {}, 'remapped_count': 0,
+    }
+    remapped = []
+    batch = []
+
+    def commit():
+        _import_batch(collection, batch, offset, remapped)
+        summary['imported'] += len(batch)
+        summary['batches'] += 1
+        summary['remapped_count'] += len(remapped)
+        for old, new in remapped:
+            if len(summary['remapped']) < IMPORT_REPORT_LIMIT:
+                summary['remapped'][str(old)] = new
+        remapped.clear()
+        batch.clear()
+
+    for line_no, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError('line is not a JSON object')
+            row, error = normalize_payload(row)
+            if error is not None:
+                raise ValueError(error)
+        except ValueError as e:
+            summary['skipped'] += 1
+            if len(summary['errors']) < IMPORT_REPORT_LIMIT:
+                summary['errors'].append({'line': line_no, 'error': str(e)})
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            commit()
+    if batch:
+        commit()
+    return summary
+
+@app.route('/api/<name>/import', methods=['POST'])
+def import_collection(name):
+    """Load an NDJSON request body, one save per batch.
+
+    ?batch_size= (default IMPORT_BATCH_SIZE); ?keep_ids=1 keeps source ids where free.
+    """
+    collection = _collection_from_path(name)
+    if collection is None:
+        return jsonify({'error': f'Unknown collection {name}'}), 404
+    try:
+        batch_size = int(request.args.get('batch_size', IMPORT_BATCH_SIZE))
+    except ValueError:
+        return jsonify({'error': 'batch_size must be an integer'}), 400
+    if batch_size < 1:
+        return jsonify({'error': 'batch_size must be >= 1'}), 400
+    keep_ids = request.args.get('keep_ids') in ('1', 'true')
+    return jsonify(import_lines(collection, request.stream, batch_size=batch_size, keep_ids=keep_ids))
+
+def _run_cli(argv):
+    """`python app.py snapshot [--full]`, `python app.py restore <snapshot_id>`, `python app.py repair-text [--dry-run]`,
+    `python app.py convert` (rewrite data files in DB_FORMAT) or `python app.py export-json <path>`."""
+    command = argv[0]
+    if command == 'snapshot':
+        manifest = create_snapshot(full='--full' in argv[1:])
+        print(f"Snapshot {manifest['id']} written ({', '.join(manifest['written'])})")
+    elif command == 'repair-text':
+        dry_run = '--dry-run' in argv[1:]
+        report = repair_stored_text(dry_run=dry_run)
+        for entry in report:
+            print(f"{entry['collection']}#{entry['id']}.{entry['field']}: {entry['before']} -> {entry['after']} bytes")
+        print(f"{len(report)} field(s) {'would be ' if dry_run else ''}repaired")
+    elif command == 'restore' and len(argv) > 1:
+        restore_snapshot(argv[1])
+        print(f"Restored snapshot {argv[1]} into {_part_path(GLOBAL_PART)}")
+    elif command == 'convert':
+        retired = convert_storage()
+        print(f"Converted {len(retired)} file(s) to {DB_FORMAT}; old files renamed with {CONVERTED_SUFFIX}")
+    elif command == 'export-json' and len(argv) > 1:
+        export_json(argv[1])
+        print(f"Exported the DB to {argv[1]}")
+    else:
+        print(_run_cli.__doc__)
+        return 2
+    return 0
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(_run_cli(sys.argv[1:]))
     port = int(os.getenv('PORT', '5050'))
+    # With the debug reloader only the serving child should run background work
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks()
     app.run(debug=True, port=port)
\ No newline at end of file
@@ -6,6 +6,7 @@ import { Paperclip, Send, ArrowLeft, Bot, User, X } from "lucide-react";
 import { Button } from "@/components/ui/button";
 import { DashboardLayout } from "@/components/dashboard-layout";
 import { api } from "@/lib/api";
+import { useCurrentUser } from "@/hooks/use-current-user";
 
 type Role = "user" | "assistant" | "system";
 type Msg = {
@@ -28,6 +29,8 @@ export default function ChatbotPage(): JSX.Element {
   const [loading, setLoading] = useState<boolean>(false);
   const [streaming, setStreaming] = useState<boolean>(false);
   const bottomRef = useRef<HTMLDivElement | null>(null);
+  // Lets the backend pull relevant excerpts from this user's uploaded documents
+  const { user } = useCurrentUser();
 
   // Pull documents context from localStorage (used by documents page)
   const documentContext = useMemo(() => {
@@ -83,6 +86,7 @@ export default function ChatbotPage(): JSX.Element {
         const formData = new FormData();
         formData.append("messages", JSON.stringify(messagesForApi));
         formData.append("file", file);
+        if (user?.id) formData.append("user_id", String(user.id));
         if (quick) formData.append("quick", "1");
         res = await fetch(api("/api/chat"), { method: "POST", body: formData });
       } else if (quick) {
@@ -92,14 +96,15 @@ export default function ChatbotPage(): JSX.Element {
           uiNext,
           messagesForApi,
           setMessages,
-          setStreaming
+          setStreaming,
+          user?.id
         );
         return;
       } else {
         res = await fetch(api("/api/chat"), {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ messages: messagesForApi }),
+          body: JSON.stringify({ messages: messagesForApi, user_id: user?.id }),
         });
       }
       if (!res.ok) throw new Error(await res.text());
@@ -304,13 +309,14 @@ async function streamAssistant(
   uiNext: Msg[],
   messagesForApi: Msg[],
   setMessages: React.Dispatch<React.SetStateAction<Msg[]>>,
-  setStreaming: (b: boolean) => void
+  setStreaming: (b: boolean) => void,
+  userId?: number
 ): Promise<void> {
   try {
     const res = await fetch(api("/api/chat/stream"), {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ messages: messagesForApi, quick: true }),
+      body: JSON.stringify({ messages: messagesForApi, quick: true, user_id: userId }),
     });
     if (!res.ok || !res.body) {
       throw new Error(await res.text());
@@ -32,16 +32,11 @@ export default function NotificationsPage() {
     setLoading(true);
     setError(null);
     try {
-      const res = await fetch(api(`/api/notifications?user_id=${user.id}`));
+      // Newest first, ordered by the backend's created_at index
+      const res = await fetch(api(`/api/notifications?user_id=${user.id}&sort=created_at&order=desc`));
       if (!res.ok) throw new Error("Failed to load notifications");
       const list = await res.json();
-      const normalized = Array.isArray(list) ? list : [];
-      const sorted = [...normalized].sort((a: Notification, b: Notification) => {
-        const aTime = a.created_at ? new Date(a.created_at).getTime() : 0;
-        const bTime = b.created_at ? new Date(b.created_at).getTime() : 0;
-        return bTime - aTime || b.id - a.id;
-      });
-      setItems(sorted);
+      setItems(Array.isArray(list) ? list : []);
     } catch (e: any) {
       setError(e?.message || "Failed to load notifications");
       setItems([]);
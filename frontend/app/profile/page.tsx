@@ -19,7 +19,7 @@ import { FileText, Camera, Shield, Edit } from "lucide-react";
 import Link from "next/link";
 import { DashboardLayout } from "@/components/dashboard-layout";
 import { useCurrentUser } from "@/hooks/use-current-user";
-import { api } from "@/lib/api";
+import { api, assetUrl } from "@/lib/api";
 
 export default function ProfilePage() {
   const { user, setUser } = useCurrentUser();
@@ -229,7 +229,7 @@ export default function ProfilePage() {
               <CardContent className="p-6 text-center">
                 <div className="relative inline-block mb-4">
                   <Avatar className="h-24 w-24">
-                  <AvatarImage src={profileData.avatarUrl || "/user-avatar.jpg"} />
+                  <AvatarImage src={assetUrl(profileData.avatarUrl) || "/user-avatar.jpg"} />
                     <AvatarFallback className="text-2xl">
                       {(profileData.name || " ")
                         .trim()
@@ -250,23 +250,14 @@ export default function ProfilePage() {
                         try {
                           const fd = new FormData()
                           fd.append("file", file)
-                          fd.append("userId", String(user.id))
-                          const res = await fetch(`/api/upload-avatar`, { method: 'POST', body: fd })
+                          fd.append("user_id", String(user.id))
+                          // The backend stores the image, links it from the profile and builds thumbnails
+                          const res = await fetch(api(`/api/avatars`), { method: 'POST', body: fd })
                           if (!res.ok) throw new Error('Upload failed')
                           const data = await res.json()
-                          const url = data?.url as string
+                          const url = data?.avatar_url as string
                           if (url) {
                             setProfileData((prev) => ({ ...prev, avatarUrl: url }))
-                            // Persist avatar url to profile immediately
-                            try {
-                              if (profileId) {
-                                await fetch(api(`/api/profiles/${profileId}`), {
-                                  method: 'PATCH',
-                                  headers: { 'Content-Type': 'application/json' },
-                                  body: JSON.stringify({ avatar_url: url }),
-                                })
-                              }
-                            } catch {}
                             try { window.dispatchEvent(new CustomEvent("medsplit:profile-updated")) } catch {}
                           }
                         } catch (err: any) {
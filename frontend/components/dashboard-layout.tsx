@@ -24,7 +24,7 @@ import Link from "next/link"
 import { usePathname } from "next/navigation"
 import { cn } from "@/lib/utils"
 import { useCurrentUser } from "@/hooks/use-current-user"
-import { api } from "@/lib/api"
+import { api, assetUrl } from "@/lib/api"
 
 const navigation = [
   { name: "Buy Meds", href: "/buy-meds", icon: ShoppingCart },
@@ -68,31 +68,18 @@ export function DashboardLayout({ children }: DashboardLayoutProps) {
     try {
       // Role label
       setRoleLabel(user.role === "doctor" ? "Doctor" : "Patient")
-      // Name from profile, fallback to email prefix
-      const pRes = await fetch(api(`/api/profiles?user_id=${user.id}`))
-      if (pRes.ok) {
-        const list = await pRes.json()
-        const p = Array.isArray(list) ? list[0] : null
-        if (p) {
-          const name = [p.first_name, p.last_name].filter(Boolean).join(" ").trim()
-          setDisplayName(name || (user.email ? String(user.email).split("@")[0] : ""))
-          setAvatarUrl(p.avatar_url || "")
-        } else {
-          setDisplayName(user.email ? String(user.email).split("@")[0] : "")
-          setAvatarUrl("")
-        }
+      // Name, avatar and unread count come from one aggregated request
+      const res = await fetch(api(`/api/users/${user.id}/dashboard`))
+      if (res.ok) {
+        const d = await res.json()
+        const p = d?.profile
+        setDisplayName(d?.display_name || (user.email ? String(user.email).split("@")[0] : ""))
+        // Sidebar only needs the small thumbnail
+        setAvatarUrl(p ? p.avatar_thumb_url || p.avatar_url || "" : "")
+        setUnreadCount(Number(d?.notifications?.unread || 0))
       } else {
         setDisplayName(user.email ? String(user.email).split("@")[0] : "")
         setAvatarUrl("")
-      }
-      // Unread notifications count
-      const nRes = await fetch(api(`/api/notifications?user_id=${user.id}`))
-      if (nRes.ok) {
-        const list = await nRes.json()
-        const arr = Array.isArray(list) ? list : []
-        const unread = arr.filter((n: any) => !n.read).length
-        setUnreadCount(unread)
-      } else {
         setUnreadCount(0)
       }
     } catch {
@@ -153,7 +140,7 @@ export function DashboardLayout({ children }: DashboardLayoutProps) {
       <div className="p-4 border-t">
         <div className="flex items-center space-x-3 mb-4 p-3 rounded-xl hover:bg-muted transition-colors">
           <Avatar className="ring-2 ring-primary/20">
-            <AvatarImage src={avatarUrl || "/user-avatar.jpg"} />
+            <AvatarImage src={assetUrl(avatarUrl) || "/user-avatar.jpg"} />
             <AvatarFallback className="bg-primary/10 text-primary font-semibold">{initials}</AvatarFallback>
           </Avatar>
           <div className="flex-1 min-w-0">
@@ -224,7 +211,7 @@ export function DashboardLayout({ children }: DashboardLayoutProps) {
                 className="hidden md:flex items-center space-x-4 hover:bg-muted rounded-xl p-3 transition-all duration-200 hover-lift"
               >
                 <Avatar className="ring-2 ring-primary/20 h-10 w-10">
-                  <AvatarImage src={avatarUrl || "/user-avatar.jpg"} />
+                  <AvatarImage src={assetUrl(avatarUrl) || "/user-avatar.jpg"} />
                   <AvatarFallback className="bg-primary/10 text-primary font-semibold">{initials}</AvatarFallback>
                 </Avatar>
                 <div className="flex-1 min-w-0">
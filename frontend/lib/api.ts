@@ -4,3 +4,9 @@ export function api(path: string) {
   if (path.startsWith("/")) return `${API_URL}${path}`;
   return `${API_URL}/${path}`;
 }
+
+// Backend-served assets (e.g. avatars) are stored as "/api/..." paths
+export function assetUrl(path?: string | null) {
+  if (!path) return "";
+  return path.startsWith("/api/") ? api(path) : path;
+}